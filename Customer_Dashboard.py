@@ -1,9 +1,10 @@
 import streamlit as st
-import duckdb as dd
 import pandas as pd
 import numpy as np
 import plotly.express as px
 from datetime import datetime
+from src.config import Config
+from src.database import ConnectionManager
 import plotly.graph_objects as go
 # -----------------------------
 # ✅ Page Config & Theming
@@ -35,21 +36,43 @@ st.markdown(
 # -----------------------------
 @st.cache_data(show_spinner=False)
 def load_tables(db_path: str):
-    conn = dd.connect(db_path)
-    try:
-        dim_customers = conn.execute("SELECT * FROM dim_customers").fetchdf()
+    # cursor อ่านอย่างเดียวจาก pool: session อื่นใช้ connection ที่เปิดไว้แล้วร่วมกัน
+    with ConnectionManager.shared(db_path).reading() as conn:
+        dim_customers = conn.execute("SELECT * FROM dim_customers_current").fetchdf()
         dim_date      = conn.execute("SELECT * FROM dim_date").fetchdf()
-        dim_staffs    = conn.execute("SELECT * FROM dim_staffs").fetchdf()
-        dim_products  = conn.execute("SELECT * FROM dim_products").fetchdf()
+        dim_staffs    = conn.execute("SELECT * FROM dim_staffs_current").fetchdf()
+        dim_products  = conn.execute("SELECT * FROM dim_products_current").fetchdf()
         dim_brands    = conn.execute("SELECT * FROM dim_brands").fetchdf()
         dim_categories= conn.execute("SELECT * FROM dim_categories").fetchdf()
-        dim_stores    = conn.execute("SELECT * FROM dim_stores").fetchdf()
-        fact_sales    = conn.execute("SELECT * FROM fact_sales").fetchdf()
-    finally:
-        conn.close()
+        dim_stores    = conn.execute("SELECT * FROM dim_stores_current").fetchdf()
+        # fact เก็บแค่ key แคบๆ: join attribute ของ dim ใน DuckDB ครั้งเดียวแทน merge ใน pandas
+        # dims ใช้ view <dim>_current (version ปัจจุบันของ SCD2) ให้ตรงกับตัวเลือกในฟิลเตอร์
+        fact_sales    = conn.execute("""
+            SELECT f.*, p.product_name, p.category_id, p.brand_id,
+                   c.category_name, b.brand_name, s.store_name,
+                   cu.customer_city, cu.customer_state,
+                   d.year, d.quarter_label AS quarter, d.month_label AS month
+            FROM fact_sales f
+            LEFT JOIN dim_date d        ON f.order_date_key = d.date_key
+            LEFT JOIN dim_products_current p ON f.product_id = p.product_id
+            LEFT JOIN dim_categories c  ON p.category_id = c.category_id
+            LEFT JOIN dim_brands b      ON p.brand_id = b.brand_id
+            LEFT JOIN dim_stores_current s ON f.store_id = s.store_id
+            LEFT JOIN dim_customers_current cu ON f.customer_id = cu.customer_id
+        """).fetchdf()
+        # metrics ต่อลูกค้า (order_count / is_repeat / RFM) คำนวณไว้แล้วใน ETL: หนึ่งแถวต่อลูกค้า
+        # มีเฉพาะเมื่อ BUILD_AGGREGATES=true ไม่มีตาราง = None แล้วคำนวณจาก fact_sales แทน
+        has_agg = conn.execute(
+            "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'agg_customer'"
+        ).fetchone()[0] > 0
+        agg_customer  = conn.execute("""
+            SELECT a.*, cu.customer_city, cu.customer_state
+            FROM agg_customer a
+            LEFT JOIN dim_customers_current cu ON a.customer_id = cu.customer_id
+        """).fetchdf() if has_agg else None
     return (
         dim_customers, dim_date, dim_staffs, dim_products,
-        dim_brands, dim_categories, dim_stores, fact_sales
+        dim_brands, dim_categories, dim_stores, fact_sales, agg_customer
     )
 
 
@@ -69,9 +92,7 @@ def pct(x):
 def add_period_cols(df):
     df = df.copy()
     df['order_date'] = pd.to_datetime(df['order_date'])
-    df['year']   = df['order_date'].dt.year
-    df['quarter']= df['order_date'].dt.to_period('Q').astype(str)
-    df['month']  = df['order_date'].dt.to_period('M').astype(str)
+    # year / quarter / month มาจาก dim_date (join ด้วย order_date_key ใน load_tables)
     df['date']   = df['order_date'].dt.date
     return df
 
@@ -96,12 +117,13 @@ def growth_rate(series: pd.Series):
 # -----------------------------
 st.sidebar.title("⚙️ ตัวกรองข้อมูล")
 
-def_path = r"C:\Users\Lenovo\Desktop\bikestore\data_warehouse\bikestore.duckdb"
+# version ที่ publish ล่าสุด (blue/green) หรือ DATABASE_PATH
+def_path = Config.get_database_path()
 DB_PATH = st.sidebar.text_input("DuckDB path", value=def_path, help="ปรับ path ตามเครื่องของคุณ")
 
 (
     dim_customers, dim_date, dim_staffs, dim_products,
-    dim_brands, dim_categories, dim_stores, fact_sales
+    dim_brands, dim_categories, dim_stores, fact_sales, agg_customer
 ) = load_tables(DB_PATH)
 
 # ทำงานด้วย pandas ทั้งหมดเพื่อความสม่ำเสมอ
@@ -117,13 +139,7 @@ sales     = fact_sales.copy()
 sales = compute_net_sales(sales)
 sales = add_period_cols(sales)
 
-# Join dims ที่จำเป็น
-products_lite = products[['product_id','product_name','category_id','brand_id']]
-sales = sales.merge(products_lite, on='product_id', how='left')
-sales = sales.merge(categories[['category_id','category_name']], on='category_id', how='left')
-sales = sales.merge(brands[['brand_id','brand_name']], on='brand_id', how='left')
-sales = sales.merge(stores[['store_id','store_name']], on='store_id', how='left')
-sales = sales.merge(customers[['customer_id','customer_city','customer_state']], on='customer_id', how='left')
+# attribute ของ dims ถูก join มาแล้วใน load_tables
 
 # วันที่ min-max สำหรับฟิลเตอร์
 min_date = pd.to_datetime(sales['order_date']).min()
@@ -163,6 +179,11 @@ if f_category:
     mask &= sales['category_name'].isin(f_category)
 
 f = sales.loc[mask].copy()
+# ไม่ได้กรองอะไร = ทั้งประวัติ ใช้ agg_customer ได้ตรงๆ
+is_unfiltered = (
+    f_date[0] == min_date.date() and f_date[1] == max_date.date()
+    and not (f_store or f_brand or f_category)
+)
 
 # -----------------------------
 # 🧭 Header
@@ -326,16 +347,19 @@ with st.expander("ตารางสรุปตามรัฐ"):
 # -----------------------------
 st.markdown("### 8) ภูมิศาสตร์ลูกค้า & ลูกค้าซื้อซ้ำ")
 colG1, colG2 = st.columns(2)
-# สรุปจำนวนออเดอร์ต่อ customer_id
-cust_orders = (
-    f.groupby('customer_id', as_index=False)['order_id']
-     .nunique()
-     .rename(columns={'order_id':'order_count'})
-).merge(
-    customers[['customer_id','customer_city','customer_state']],
-    on='customer_id', how='left'
-)
-cust_orders['is_repeat'] = cust_orders['order_count'] > 1
+# สรุปจำนวนออเดอร์ต่อ customer_id (ไม่มีตัวกรอง: อ่านจาก agg_customer แทน groupby ทั้ง fact)
+if is_unfiltered and agg_customer is not None:
+    cust_orders = agg_customer[['customer_id','order_count','customer_city','customer_state','is_repeat']].copy()
+else:
+    cust_orders = (
+        f.groupby('customer_id', as_index=False)['order_id']
+         .nunique()
+         .rename(columns={'order_id':'order_count'})
+    ).merge(
+        customers[['customer_id','customer_city','customer_state']],
+        on='customer_id', how='left'
+    )
+    cust_orders['is_repeat'] = cust_orders['order_count'] > 1
 
 # สรุประดับเมือง/รัฐ
 repeat_city = cust_orders.groupby('customer_city', as_index=False) \
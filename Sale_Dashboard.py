@@ -1,9 +1,10 @@
 import streamlit as st
-import duckdb as dd
 import pandas as pd
 import numpy as np
 import plotly.express as px
 from datetime import datetime
+from src.config import Config
+from src.database import ConnectionManager
 
 # -----------------------------
 # ✅ Page Config & Theming
@@ -35,18 +36,30 @@ st.markdown(
 # -----------------------------
 @st.cache_data(show_spinner=False)
 def load_tables(db_path: str):
-    conn = dd.connect(db_path)
-    try:
-        dim_customers = conn.execute("SELECT * FROM dim_customers").fetchdf()
+    # cursor อ่านอย่างเดียวจาก pool: session อื่นใช้ connection ที่เปิดไว้แล้วร่วมกัน
+    with ConnectionManager.shared(db_path).reading() as conn:
+        dim_customers = conn.execute("SELECT * FROM dim_customers_current").fetchdf()
         dim_date      = conn.execute("SELECT * FROM dim_date").fetchdf()
-        dim_staffs    = conn.execute("SELECT * FROM dim_staffs").fetchdf()
-        dim_products  = conn.execute("SELECT * FROM dim_products").fetchdf()
+        dim_staffs    = conn.execute("SELECT * FROM dim_staffs_current").fetchdf()
+        dim_products  = conn.execute("SELECT * FROM dim_products_current").fetchdf()
         dim_brands    = conn.execute("SELECT * FROM dim_brands").fetchdf()
         dim_categories= conn.execute("SELECT * FROM dim_categories").fetchdf()
-        dim_stores    = conn.execute("SELECT * FROM dim_stores").fetchdf()
-        fact_sales    = conn.execute("SELECT * FROM fact_sales").fetchdf()
-    finally:
-        conn.close()
+        dim_stores    = conn.execute("SELECT * FROM dim_stores_current").fetchdf()
+        # fact เก็บแค่ key แคบๆ: join attribute ของ dim ใน DuckDB ครั้งเดียวแทน merge ใน pandas
+        # dims ใช้ view <dim>_current (version ปัจจุบันของ SCD2) ให้ตรงกับตัวเลือกในฟิลเตอร์
+        fact_sales    = conn.execute("""
+            SELECT f.*, p.product_name, p.category_id, p.brand_id,
+                   c.category_name, b.brand_name, s.store_name,
+                   cu.customer_city, cu.customer_state,
+                   d.year, d.quarter_label AS quarter, d.month_label AS month
+            FROM fact_sales f
+            LEFT JOIN dim_date d        ON f.order_date_key = d.date_key
+            LEFT JOIN dim_products_current p ON f.product_id = p.product_id
+            LEFT JOIN dim_categories c  ON p.category_id = c.category_id
+            LEFT JOIN dim_brands b      ON p.brand_id = b.brand_id
+            LEFT JOIN dim_stores_current s ON f.store_id = s.store_id
+            LEFT JOIN dim_customers_current cu ON f.customer_id = cu.customer_id
+        """).fetchdf()
     return (
         dim_customers, dim_date, dim_staffs, dim_products,
         dim_brands, dim_categories, dim_stores, fact_sales
@@ -69,9 +82,7 @@ def pct(x):
 def add_period_cols(df):
     df = df.copy()
     df['order_date'] = pd.to_datetime(df['order_date'])
-    df['year']   = df['order_date'].dt.year
-    df['quarter']= df['order_date'].dt.to_period('Q').astype(str)
-    df['month']  = df['order_date'].dt.to_period('M').astype(str)
+    # year / quarter / month มาจาก dim_date (join ด้วย order_date_key ใน load_tables)
     df['date']   = df['order_date'].dt.date
     return df
 
@@ -96,7 +107,8 @@ def growth_rate(series: pd.Series):
 # -----------------------------
 st.sidebar.title("⚙️ ตัวกรองข้อมูล")
 
-def_path = r"C:\Users\Lenovo\Desktop\bikestore\data_warehouse\bikestore.duckdb"
+# version ที่ publish ล่าสุด (blue/green) หรือ DATABASE_PATH
+def_path = Config.get_database_path()
 DB_PATH = st.sidebar.text_input("DuckDB path", value=def_path, help="ปรับ path ตามเครื่องของคุณ")
 
 (
@@ -117,13 +129,7 @@ sales     = fact_sales.copy()
 sales = compute_net_sales(sales)
 sales = add_period_cols(sales)
 
-# Join dims ที่จำเป็น
-products_lite = products[['product_id','product_name','category_id','brand_id']]
-sales = sales.merge(products_lite, on='product_id', how='left')
-sales = sales.merge(categories[['category_id','category_name']], on='category_id', how='left')
-sales = sales.merge(brands[['brand_id','brand_name']], on='brand_id', how='left')
-sales = sales.merge(stores[['store_id','store_name']], on='store_id', how='left')
-sales = sales.merge(customers[['customer_id','customer_city','customer_state']], on='customer_id', how='left')
+# attribute ของ dims ถูก join มาแล้วใน load_tables
 
 # วันที่ min-max สำหรับฟิลเตอร์
 min_date = pd.to_datetime(sales['order_date']).min()
@@ -281,8 +287,12 @@ st.plotly_chart(fig_tree, use_container_width=True)
 # 💸 ผลของส่วนลดต่อปริมาณ/รายได้
 # -----------------------------
 st.markdown("### 7) ผลของส่วนลดต่อปริมาณ/รายได้")
-f2['discount_range'] = pd.cut(f2['discount'], bins=[-0.01, 0.1, 0.2, 1], labels=['0-10%','10-20%','>20%'])
-disc = f2.groupby('discount_range', as_index=False).agg(total_qty=('quantity','sum'), total_sales=('net_sales','sum'))
+# discount_bucket คำนวณไว้แล้วใน ETL
+disc = (
+    f2.groupby('discount_bucket', as_index=False)
+      .agg(total_qty=('quantity','sum'), total_sales=('net_sales','sum'))
+      .rename(columns={'discount_bucket': 'discount_range'})
+)
 
 tabD1, tabD2 = st.tabs(["ปริมาณ (ชิ้น)", "รายได้ (฿)"])
 with tabD1:
@@ -1,8 +1,6 @@
 import streamlit as st
-import duckdb as dd
 import polars as pl
-
-conn = dd.connect(r'C:\Users\Lenovo\Desktop\bikestore\data_warehouse\bikestore.duckdb')
+from src.database import ConnectionManager
 
 def execute_query(conn, query):
         result = conn.execute(query).fetchdf()
@@ -18,15 +16,15 @@ st.title("📊 Dashboard Overview")
 st.write("เลือกดูรายละเอียดของ Dashboard แต่ละหน้าได้จากเมนูด้านซ้าย หรือกดลิงก์ด้านล่าง")
     
 # ...existing code...
-dim_customers = execute_query(conn, "SELECT * FROM dim_customers")
-dim_date = execute_query(conn, "SELECT * FROM dim_date")
-dim_staffs = execute_query(conn, "SELECT * FROM dim_staffs")
-dim_products = execute_query(conn, "SELECT * FROM dim_products")
-dim_brands = execute_query(conn, "SELECT * FROM dim_brands")
-dim_categories = execute_query(conn, "SELECT * FROM dim_categories")
-dim_stores = execute_query(conn, "SELECT * FROM dim_stores")
-fact_sales = execute_query(conn, "SELECT * FROM fact_sales")
-conn.close()
+with ConnectionManager.shared().reading() as conn:
+    dim_customers = execute_query(conn, "SELECT * FROM dim_customers")
+    dim_date = execute_query(conn, "SELECT * FROM dim_date")
+    dim_staffs = execute_query(conn, "SELECT * FROM dim_staffs")
+    dim_products = execute_query(conn, "SELECT * FROM dim_products")
+    dim_brands = execute_query(conn, "SELECT * FROM dim_brands")
+    dim_categories = execute_query(conn, "SELECT * FROM dim_categories")
+    dim_stores = execute_query(conn, "SELECT * FROM dim_stores")
+    fact_sales = execute_query(conn, "SELECT * FROM fact_sales")
 
 st.write("### dim_customers")
 st.write(dim_customers.head(5))
@@ -3,6 +3,8 @@ Configuration management for the Data Warehouse project
 """
 
 import os
+import glob
+import polars as pl
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -20,15 +22,100 @@ class Config:
     DATABASE_PATH = os.getenv("DATABASE_PATH", "data_warehouse/bikestore.duckdb")
     DATABASE_NAME = os.getenv("DATABASE_NAME", "bikestore.duckdb")
 
+    # Blue/green publish: every run builds a new version file next to DATABASE_PATH and
+    # readers switch to it (PUBLISH_POINTER) only after the run succeeded
+    BLUE_GREEN = os.getenv("BLUE_GREEN", "false").lower() == "true"
+    PUBLISH_POINTER = os.getenv("PUBLISH_POINTER", DATABASE_PATH + ".current")
+    # Every publish / rollback in order (JSON); rollback and pruning follow it, not file names
+    PUBLISH_HISTORY = os.getenv("PUBLISH_HISTORY", DATABASE_PATH + ".history")
+    # Published versions kept on disk: the live one plus older ones for rollback
+    PUBLISH_KEEP_VERSIONS = int(os.getenv("PUBLISH_KEEP_VERSIONS", 2))
+
+    # DuckDB settings of every warehouse connection, e.g. "4", "4GB", "/tmp/duckdb" (empty = DuckDB default)
+    DUCKDB_THREADS = os.getenv("DUCKDB_THREADS", "")
+    DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "")
+    DUCKDB_TEMP_DIRECTORY = os.getenv("DUCKDB_TEMP_DIRECTORY", "")
+    # Idle read-only cursors the dashboards keep for reuse (see src/database.py)
+    READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", 4))
+
     # ETL configuration
     BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1000))
+    # ตารางที่อ่าน/แปลง/โหลดทีละ batch (BATCH_SIZE แถว) เช่น "order_items,customers"
+    # Validation: primary keys are checked across batches (a repeated key keeps its first row,
+    # as in a full load), foreign keys against the whole source files
+    BATCHED_TABLES = [t.strip() for t in os.getenv("BATCHED_TABLES", "").split(",") if t.strip()]
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
+    # Extract configuration
+    EXTRACT_PARALLEL = os.getenv("EXTRACT_PARALLEL", "false").lower() == "true"
+    EXTRACT_EXECUTOR = os.getenv("EXTRACT_EXECUTOR", "thread")  # "thread" or "process"
+    EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", os.cpu_count() or 4))
+
+    # Load into the typed tables of create_schema (INSERT BY NAME) instead of re-creating them from the data
+    TYPED_LOAD = os.getenv("TYPED_LOAD", "true").lower() == "true"
+
+    # Load the transformed tables concurrently (one DuckDB cursor each) and commit them together
+    LOAD_PARALLEL = os.getenv("LOAD_PARALLEL", "false").lower() == "true"
+    LOAD_MAX_WORKERS = int(os.getenv("LOAD_MAX_WORKERS", os.cpu_count() or 4))
+
+    # Source tables landed straight into DuckDB (read_csv) and transformed with SQL, e.g. "orders,order_items"
+    DUCKDB_NATIVE_TABLES = [t.strip() for t in os.getenv("DUCKDB_NATIVE_TABLES", "").split(",") if t.strip()]
+
+    # Fact load: "full" rebuild or "incremental" (order watermark + upsert)
+    FACT_LOAD_MODE = os.getenv("FACT_LOAD_MODE", "full")
+    # จำนวนวันย้อนหลังจาก order_date ล่าสุดที่ยังรับการแก้ไข (late updates เช่น shipped_date)
+    FACT_CHANGE_WINDOW_DAYS = int(os.getenv("FACT_CHANGE_WINDOW_DAYS", 7))
+
+    # Lazy mode: extract returns LazyFrames and everything is collected once at load time
+    LAZY_MODE = os.getenv("LAZY_MODE", "false").lower() == "true"
+    STREAMING_COLLECT = os.getenv("STREAMING_COLLECT", "true").lower() == "true"
+    # Log the optimized query plan of every transformed table
+    EXPLAIN_PLANS = os.getenv("EXPLAIN_PLANS", "false").lower() == "true"
+
+    # Extract cache: parsed tables stored as Arrow IPC / Parquet under PROCESSED_DATA_DIR
+    EXTRACT_CACHE = os.getenv("EXTRACT_CACHE", "false").lower() == "true"
+    CACHE_FORMAT = os.getenv("CACHE_FORMAT", "ipc")  # "ipc" or "parquet"
+    CACHE_CONTENT_HASH = os.getenv("CACHE_CONTENT_HASH", "false").lower() == "true"
+    CACHE_KEEP_VERSIONS = int(os.getenv("CACHE_KEEP_VERSIONS", 1))
+
+    # Dimensions kept as SCD Type 2 history (valid_from / valid_to / is_current)
+    SCD2_TABLES = [t.strip() for t in os.getenv(
+        "SCD2_TABLES", "dim_customers,dim_products,dim_staffs,dim_stores").split(",") if t.strip()]
+
+    # Data-quality checks between transform and load; failing rows go to reject_<table>
+    VALIDATE_DATA = os.getenv("VALIDATE_DATA", "true").lower() == "true"
+
+    # Date of the inventory snapshot (YYYY-MM-DD); empty = the day of the run.
+    # Must not be earlier than the latest snapshot already stored
+    INVENTORY_SNAPSHOT_DATE = os.getenv("INVENTORY_SNAPSHOT_DATE", "")
+
+    # Sales cubes (agg_sales_*) and customer metrics (agg_customer) rebuilt from fact_sales after every load
+    BUILD_AGGREGATES = os.getenv("BUILD_AGGREGATES", "true").lower() == "true"
+
+    # Facts also stored as Hive-partitioned Parquet (year=/month=) with a <table>_partitioned view, e.g. "fact_sales"
+    PARTITIONED_FACTS = [t.strip() for t in os.getenv("PARTITIONED_FACTS", "").split(",") if t.strip()]
+    PARTITION_DIR = os.getenv("PARTITION_DIR", os.path.join(DATABASE_DIR, "partitions"))
+
+    # Post-load optimize: sort facts, build ART indexes, ANALYZE and CHECKPOINT
+    OPTIMIZE_WAREHOUSE = os.getenv("OPTIMIZE_WAREHOUSE", "true").lower() == "true"
+
+    # Parquet lake: dim_/fact_/agg_ tables exported as zstd Parquet + manifest.json + lake.duckdb views
+    EXPORT_LAKE = os.getenv("EXPORT_LAKE", "false").lower() == "true"
+    LAKE_DIR = os.getenv("LAKE_DIR", os.path.join(DATABASE_DIR, "lake"))
+    LAKE_ROW_GROUP_SIZE = int(os.getenv("LAKE_ROW_GROUP_SIZE", 122880))
+
+    # dim_date covers the fact dates plus this many days on each side
+    DATE_DIM_PADDING_DAYS = int(os.getenv("DATE_DIM_PADDING_DAYS", 365))
+
+    # Incremental runs: skip tables whose source fingerprints did not change since the last run
+    INCREMENTAL_RUNS = os.getenv("INCREMENTAL_RUNS", "false").lower() == "true"
+
     # Date formats
     DATE_FORMAT = os.getenv("DATE_FORMAT", "%Y-%m-%d")
     DATETIME_FORMAT = os.getenv("DATETIME_FORMAT", "%Y-%m-%d %H:%M:%S")
 
     # CSV files mapping
+    # ค่าเป็น glob pattern ได้ (เช่น "orders_2024-*.csv.gz") และรองรับไฟล์บีบอัด .gz / .zst
     CSV_FILES = {
         "brands": "brands.csv",
         "categories": "categories.csv",
@@ -41,6 +128,82 @@ class Config:
         "stores": "stores.csv"
     }
 
+    # Pinned CSV schemas (no type inference). Date columns are parsed with DATE_FORMAT.
+    # ตารางที่ไม่มีใน registry จะกลับไปใช้ inference + try_parse_dates แบบเดิม
+    CSV_SCHEMAS = {
+        "brands": {
+            "brand_id": pl.Int16,
+            "brand_name": pl.Categorical,
+        },
+        "categories": {
+            "category_id": pl.Int16,
+            "category_name": pl.Categorical,
+        },
+        "customers": {
+            "customer_id": pl.Int32,
+            "first_name": pl.String,
+            "last_name": pl.String,
+            "phone": pl.String,
+            "email": pl.String,
+            "street": pl.String,
+            "city": pl.Categorical,
+            "state": pl.Categorical,
+            "zip_code": pl.String,
+        },
+        "order_items": {
+            "order_id": pl.Int32,
+            "item_id": pl.Int16,
+            "product_id": pl.Int32,
+            "quantity": pl.Int16,
+            # ราคา/ส่วนลดคง Float64: Float32 ทำให้ net_amount เพี้ยน ส่วน Decimal เป็น int128 ใน Polars
+            "list_price": pl.Float64,
+            "discount": pl.Float64,
+        },
+        "orders": {
+            "order_id": pl.Int32,
+            "customer_id": pl.Int32,
+            "order_status": pl.Int8,
+            "order_date": pl.Date,
+            "required_date": pl.Date,
+            "shipped_date": pl.Date,
+            "store_id": pl.Int16,
+            "staff_id": pl.Int16,
+        },
+        "products": {
+            "product_id": pl.Int32,
+            "product_name": pl.String,
+            "brand_id": pl.Int16,
+            "category_id": pl.Int16,
+            "model_year": pl.Int16,
+            "list_price": pl.Float64,
+        },
+        "staffs": {
+            "staff_id": pl.Int16,
+            "first_name": pl.String,
+            "last_name": pl.String,
+            "email": pl.String,
+            "phone": pl.String,
+            "active": pl.Int8,
+            "store_id": pl.Int16,
+            "manager_id": pl.Int16,
+        },
+        "stocks": {
+            "store_id": pl.Int16,
+            "product_id": pl.Int32,
+            "quantity": pl.Int32,
+        },
+        "stores": {
+            "store_id": pl.Int16,
+            "store_name": pl.String,
+            "phone": pl.String,
+            "email": pl.String,
+            "street": pl.String,
+            "city": pl.Categorical,
+            "state": pl.Categorical,
+            "zip_code": pl.String,
+        },
+    }
+
     @classmethod
     def get_csv_path(cls, table_name: str) -> str:
         """Get the full path to a CSV file"""
@@ -48,6 +211,20 @@ class Config:
             raise ValueError(f"Unknown table: {table_name}")
         return os.path.join(cls.DATA_DIR, cls.CSV_FILES[table_name])
 
+    @classmethod
+    def get_csv_paths(cls, table_name: str) -> list:
+        """Get every existing file of a table (CSV_FILES entries may be glob patterns)"""
+        pattern = cls.get_csv_path(table_name)
+        if any(ch in pattern for ch in "*?["):
+            return sorted(glob.glob(pattern))
+        return [pattern] if os.path.exists(pattern) else []
+
     @classmethod
     def get_database_path(cls) -> str:
-        """Get the full path to the database file"""
\ No newline at end of file
+        """Get the full path to the database file (the published version under BLUE_GREEN)"""
+        if cls.BLUE_GREEN and os.path.exists(cls.PUBLISH_POINTER):
+            with open(cls.PUBLISH_POINTER, encoding="utf-8") as f:
+                version = f.read().strip()
+            if version:
+                return os.path.join(os.path.dirname(cls.DATABASE_PATH), version)
+        return cls.DATABASE_PATH
\ No newline at end of file
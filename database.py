@@ -0,0 +1,154 @@
+"""
+Warehouse connection manager: one read-write connection for the ETL and pooled read-only cursors for readers
+"""
+
+import duckdb as dd
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+from src.config import Config
+
+
+# Setup logging
+logging.basicConfig(level=getattr(logging, Config.LOG_LEVEL),
+                    format='%(asctime)s - %(levelname)s - %(message)s'
+                    )
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """Shared DuckDB connections of one warehouse file"""
+
+    # หนึ่ง manager ต่อไฟล์ต่อ process (ดู shared)
+    _managers: Dict[str, "ConnectionManager"] = {}
+    _managers_lock = threading.Lock()
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.config = Config()
+        self.db_path = str(db_path or self.config.get_database_path())
+        self.writer = None
+        self.reader = None
+        # idle cursors ready for reuse, at most Config.READ_POOL_SIZE
+        self.idle = queue.LifoQueue(maxsize=max(1, self.config.READ_POOL_SIZE))
+        self.checked_out = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, db_path: Optional[str] = None) -> "ConnectionManager":
+        """
+        Process-wide manager of a warehouse file
+        Args:
+            db_path: database file; default Config.get_database_path() (the published version under BLUE_GREEN)
+        """
+        db_path = str(db_path or Config.get_database_path())
+        with cls._managers_lock:
+            if db_path not in cls._managers:
+                # blue/green publish ไปไฟล์ใหม่: ปิด reader ของ version เก่าที่ไม่มีใครใช้ เพื่อให้ลบไฟล์ได้
+                for path, manager in list(cls._managers.items()):
+                    if manager.release_idle():
+                        del cls._managers[path]
+                cls._managers[db_path] = cls(db_path)
+            return cls._managers[db_path]
+
+    @classmethod
+    def close_shared(cls, db_path: Optional[str] = None):
+        """
+        Close and forget the shared manager of db_path (every manager when None)
+        Closing the read-write connection checkpoints the file.
+        """
+        with cls._managers_lock:
+            paths = list(cls._managers) if db_path is None else [str(db_path)]
+            managers = [cls._managers.pop(path) for path in paths if path in cls._managers]
+        for manager in managers:
+            manager.close()
+
+    def settings(self) -> Dict[str, str]:
+        """DuckDB settings of every connection (Config.DUCKDB_*; empty = DuckDB default)"""
+        settings = {
+            "threads": self.config.DUCKDB_THREADS,
+            "memory_limit": self.config.DUCKDB_MEMORY_LIMIT,
+            "temp_directory": self.config.DUCKDB_TEMP_DIRECTORY,
+        }
+        return {name: value for name, value in settings.items() if value}
+
+    def connect_writer(self) -> dd.DuckDBPyConnection:
+        """
+        The read-write connection of the ETL, opened on first use
+        Returns:
+            DuckDB connection object
+        """
+        with self.lock:
+            if self.writer is None:
+                if self.reader is not None:
+                    raise RuntimeError(f"{self.db_path} is open read-only in this process")
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                self.writer = dd.connect(self.db_path, config=self.settings())
+                logger.info(f"Opened read-write connection to {self.db_path}")
+            return self.writer
+
+    def cursor(self) -> dd.DuckDBPyConnection:
+        """
+        Cursor for a reader; hand it back with release() (or use reading())
+        Cursors share one read-only database instance, so its catalog and buffer cache stay warm.
+        In the ETL process they come from the read-write connection instead.
+        """
+        with self.lock:
+            try:
+                cursor = self.idle.get_nowait()
+            except queue.Empty:
+                if self.writer is None and self.reader is None:
+                    self.reader = dd.connect(self.db_path, read_only=True, config=self.settings())
+                    logger.info(f"Opened read-only connection to {self.db_path}")
+                cursor = (self.writer or self.reader).cursor()
+            self.checked_out += 1
+            return cursor
+
+    def release(self, cursor: dd.DuckDBPyConnection):
+        """Return a cursor from cursor() to the pool"""
+        with self.lock:
+            self.checked_out -= 1
+            # ไม่มี blue/green: ETL เขียนไฟล์เดียวกันนี้ จึงต้องปล่อย file lock เมื่อไม่มี reader ใช้งาน
+            keep_open = self.config.BLUE_GREEN or self.writer is not None
+            if keep_open and not self.idle.full():
+                self.idle.put_nowait(cursor)
+                return
+            cursor.close()
+            if not keep_open and self.checked_out == 0:
+                self.close_reader()
+
+    @contextmanager
+    def reading(self):
+        """Borrow a pooled cursor for a block"""
+        cursor = self.cursor()
+        try:
+            yield cursor
+        finally:
+            self.release(cursor)
+
+    def release_idle(self) -> bool:
+        """Close the read-only connection if no cursor is in use; True if the manager holds nothing open"""
+        with self.lock:
+            if self.writer is not None or self.checked_out:
+                return False
+            self.close_reader()
+            return True
+
+    def close_reader(self):
+        """Close the idle cursors and the read-only connection (caller holds self.lock)"""
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def close(self):
+        """Close every connection of this manager"""
+        with self.lock:
+            self.close_reader()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+                logger.info(f"Closed read-write connection to {self.db_path}")
@@ -1,6 +1,10 @@
 import polars as pl
 import os
-from typing import Dict , Optional
+import glob
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Dict , Optional, Tuple
 from src.config import Config
 import logging
 
@@ -10,6 +14,123 @@ logging.basicConfig(level=getattr(logging, Config.LOG_LEVEL),
                     )
 logger = logging.getLogger(__name__)
 
+NULL_VALUES = ["", "NULL", "null", "N/A", "n/a"]
+
+def file_fingerprint(file_path: str, content_hash: bool = False) -> str:
+    """
+    Fingerprint a source file from its path, size and mtime
+    Args:
+        file_path: path to the file
+        content_hash: also hash the file content (slower, but survives touch/copy)
+    Returns:
+        str: hex digest
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    digest.update(f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    if content_hash:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(file_path: str, content_hash: bool = False) -> str:
+    """
+    Fingerprint a table source, which may be a glob pattern matching several files
+    Adding, removing or changing any matching file changes the fingerprint.
+    """
+    files = sorted(glob.glob(file_path)) if any(ch in file_path for ch in "*?[") else [file_path]
+    if len(files) == 1:
+        return file_fingerprint(files[0], content_hash)
+    digest = hashlib.sha256()
+    for f in files:
+        digest.update(file_fingerprint(f, content_hash).encode())
+    return digest.hexdigest()
+
+
+class ExtractCache:
+    """
+    Columnar cache of parsed CSV tables
+    Each table is stored as <table>-<fingerprint>.arrow (or .parquet) under
+    PROCESSED_DATA_DIR/extract_cache, so an unchanged source is served by a
+    memory-mapped columnar read instead of a CSV parse.
+    """
+
+    # เปลี่ยนค่านี้เมื่อแก้ option การอ่าน CSV ใน extract_csv เพื่อให้ cache เดิมใช้ไม่ได้
+    READER_VERSION = "2"
+
+    def __init__(self):
+        self.config = Config()
+        self.cache_dir = os.path.join(self.config.PROCESSED_DATA_DIR, "extract_cache")
+        self.ext = "parquet" if self.config.CACHE_FORMAT == "parquet" else "arrow"
+
+    def cache_key(self, table_name: str, file_path: str) -> str:
+        """Cache key = source fingerprint + reader version + pinned schema + date formats"""
+        fingerprint = source_fingerprint(file_path, self.config.CACHE_CONTENT_HASH)
+        schema = self.config.CSV_SCHEMAS.get(table_name)
+        # parse_dates ใช้ DATE_FORMAT / DATETIME_FORMAT: เปลี่ยน format แล้วต้อง parse ใหม่
+        formats = f"{self.config.DATE_FORMAT}|{self.config.DATETIME_FORMAT}"
+        return hashlib.sha256(f"{fingerprint}|{self.READER_VERSION}|{schema}|{formats}".encode()).hexdigest()[:20]
+
+    def cache_path(self, table_name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{table_name}-{key}.{self.ext}")
+
+    def get(self, table_name: str, file_path: str, lazy: bool = False):
+        """
+        Return the cached table, or None on a cache miss
+        Args:
+            lazy: return a LazyFrame scan instead of a DataFrame
+        """
+        path = self.cache_path(table_name, self.cache_key(table_name, file_path))
+        if not os.path.exists(path):
+            return None
+
+        logger.info(f"Cache hit for {table_name}: {path}")
+        if self.ext == "parquet":
+            return pl.scan_parquet(path) if lazy else pl.read_parquet(path, memory_map=True)
+        # read_ipc memory-map ไฟล์ IPC ที่ไม่บีบอัดเองอยู่แล้ว
+        return pl.scan_ipc(path) if lazy else pl.read_ipc(path)
+
+    def put(self, table_name: str, file_path: str, df) -> str:
+        """
+        Store a parsed table (DataFrame or LazyFrame) and evict stale versions
+        Returns:
+            str: path of the cache file
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(table_name, self.cache_key(table_name, file_path))
+        tmp_path = f"{path}.tmp"
+
+        # IPC ไม่บีบอัดเพื่อให้ memory-map ได้, Parquet ใช้ zstd
+        if isinstance(df, pl.LazyFrame):
+            if self.ext == "parquet":
+                df.sink_parquet(tmp_path, compression="zstd")
+            else:
+                df.sink_ipc(tmp_path, compression="uncompressed")
+        elif self.ext == "parquet":
+            df.write_parquet(tmp_path, compression="zstd")
+        else:
+            df.write_ipc(tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+
+        logger.info(f"Cached {table_name} at {path}")
+        self.evict(table_name)
+        return path
+
+    def evict(self, table_name: str):
+        """Keep only the newest CACHE_KEEP_VERSIONS files of a table"""
+        versions = sorted(glob.glob(os.path.join(self.cache_dir, f"{table_name}-*.{self.ext}")),
+                          key=os.path.getmtime, reverse=True)
+        for stale in versions[max(self.config.CACHE_KEEP_VERSIONS, 1):]:
+            try:
+                os.remove(stale)
+                logger.info(f"Evicted stale cache file {stale}")
+            except OSError as e:
+                # Windows ลบไฟล์ที่ยัง memory-map อยู่ไม่ได้ จะลองใหม่รอบหน้า
+                logger.warning(f"Could not evict {stale}: {e}")
+
+
 class SrcChecker:
     """
     Class for checking the existence of source files
@@ -31,7 +152,7 @@ class SrcChecker:
 
         for table_name, file_name in self.config.CSV_FILES.items():
             file_path = self.config.get_csv_path(table_name)
-            if not os.path.exists(file_path):
+            if not self.config.get_csv_paths(table_name):
                 missing_files.append(file_path)
 
         if missing_files:
@@ -43,6 +164,54 @@ class SrcChecker:
         logger.info("✅ All source files found!")
 
         return True
+
+    def source_fingerprints(self) -> Dict[str, str]:
+        """
+        Fingerprint every source file (path, size, mtime and optionally content)
+        Returns:
+            dict: table name -> fingerprint
+        """
+        return {
+            table_name: source_fingerprint(self.config.get_csv_path(table_name), self.config.CACHE_CONTENT_HASH)
+            for table_name in self.config.CSV_FILES
+        }
+
+    def load_fingerprints(self, connection) -> Dict[str, str]:
+        """
+        Read the fingerprints recorded by the last successful run from the warehouse
+        Args:
+            connection: DuckDB connection to the warehouse
+        """
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS etl_source_state (
+                table_name VARCHAR PRIMARY KEY,
+                fingerprint VARCHAR,
+                updated_at TIMESTAMP
+            )
+        """)
+        rows = connection.execute("SELECT table_name, fingerprint FROM etl_source_state").fetchall()
+        return dict(rows)
+
+    def changed_sources(self, connection, fingerprints: Optional[Dict[str, str]] = None) -> list:
+        """
+        Compare current fingerprints with the recorded ones
+        Returns:
+            list: source tables that are new or changed since the last run
+        """
+        fingerprints = fingerprints or self.source_fingerprints()
+        recorded = self.load_fingerprints(connection)
+        changed = [name for name, fp in fingerprints.items() if recorded.get(name) != fp]
+        logger.info(f"Changed sources: {changed if changed else 'none'}")
+        return changed
+
+    def save_fingerprints(self, connection, fingerprints: Dict[str, str]):
+        """Record fingerprints after a successful run"""
+        self.load_fingerprints(connection)
+        connection.executemany(
+            "INSERT OR REPLACE INTO etl_source_state VALUES (?, ?, current_timestamp)",
+            list(fingerprints.items())
+        )
+        logger.info(f"Recorded fingerprints for {len(fingerprints)} sources")
     def run_extract(self) -> dict:
         """
         Run the extract step of the ETL pipeline
@@ -62,22 +231,164 @@ class DataExtractor:
     
     def __init__(self):
         self.config = Config()
+        self.cache = ExtractCache()
     
+    def csv_read_options(self, table_name: str) -> dict:
+        """
+        Keyword arguments for pl.read_csv / pl.scan_csv
+        Tables in Config.CSV_SCHEMAS are read with their pinned dtypes and no
+        inference pass; Date columns come in as strings and are parsed by parse_dates.
+        """
+        options = {"encoding": "utf8", "null_values": NULL_VALUES}
+        schema = self.config.CSV_SCHEMAS.get(table_name)
+        if schema is None:
+            # try_parse_dates=True ช่วยให้ Polars พยายามแปลงคอลัมน์ที่เป็นวันที่ให้เป็นชนิดข้อมูล DateTime
+            options["try_parse_dates"] = True
+            return options
+
+        options["infer_schema"] = False
+        options["schema_overrides"] = {
+            col: (pl.String if dtype == pl.Date else dtype) for col, dtype in schema.items()
+        }
+        return options
+
+    def parse_dates(self, df, table_name: str):
+        """Parse the pinned Date columns of a table with Config.DATE_FORMAT"""
+        schema = self.config.CSV_SCHEMAS.get(table_name) or {}
+        date_cols = [col for col, dtype in schema.items() if dtype == pl.Date]
+        if not date_cols:
+            return df
+        return df.with_columns(pl.col(date_cols).str.to_date(self.config.DATE_FORMAT))
+
+    def source_files(self, file_path: str) -> list:
+        """Expand a source path or glob pattern into the list of files to read"""
+        if any(ch in file_path for ch in "*?["):
+            return sorted(glob.glob(file_path))
+        return [file_path]
+
+    def is_plain_file(self, file_path: str) -> bool:
+        """True for a single uncompressed CSV (read with pl.read_csv as before)"""
+        return not any(ch in file_path for ch in "*?[") and not file_path.endswith((".gz", ".zst", ".zlib"))
+
     def extract_csv(self,file_path: str, table_name: str) -> pl.DataFrame:
 
         try:
             logger.info("Starting ETL process...")
-            df = pl.read_csv(file_path,encoding="utf-8",
-                    try_parse_dates=True,
-                    null_values=["", "NULL", "null", "N/A", "n/a"])
-                # try_parse_dates=True ช่วยให้ Polars พยายามแปลงคอลัมน์ที่เป็นวันที่ให้เป็นชนิดข้อมูล DateTime
+            if self.is_plain_file(file_path):
+                df = pl.read_csv(file_path, **self.csv_read_options(table_name))
+                df = self.parse_dates(df, table_name)
+            else:
+                # หลายไฟล์/ไฟล์บีบอัด: scan_csv แตกไฟล์แบบ streaming และ parse แต่ละไฟล์พร้อมกัน
+                df = self.scan_csv(file_path, table_name).collect()
             logging.info(f"Successfully extracted {len(df)} rows from {table_name}")
             return df
         except Exception as e:
             logging.error(f"Error reading {file_path}: {e}")
             return None
 
-    def extract_data(self) -> dict:
+    def scan_csv(self, file_path: str, table_name: str) -> pl.LazyFrame:
+        """
+        Lazily scan a CSV file (lazy mode)
+        Nothing is read here; projection and predicate pushdown happen when the plan is collected.
+        Returns:
+            pl.LazyFrame: query plan over the CSV file
+        """
+        try:
+            files = self.source_files(file_path)
+            lf = pl.scan_csv(files, **self.csv_read_options(table_name))
+            lf = self.parse_dates(lf, table_name)
+            logger.info(f"Created lazy scan for {table_name} ({len(files)} file(s))")
+            return lf
+        except Exception as e:
+            logger.error(f"Error scanning {file_path}: {e}")
+            return None
+
+    def read_table(self, file_path: str, table_name: str) -> pl.DataFrame:
+        """
+        Read a table, going through the columnar cache when EXTRACT_CACHE is on
+        """
+        if not self.config.EXTRACT_CACHE:
+            return self.extract_csv(file_path, table_name)
+
+        df = self.cache.get(table_name, file_path)
+        if df is None:
+            df = self.extract_csv(file_path, table_name)
+            if df is not None:
+                self.cache.put(table_name, file_path, df)
+        return df
+
+    def scan_table(self, file_path: str, table_name: str) -> pl.LazyFrame:
+        """
+        Lazy version of read_table
+        On a cache miss the CSV scan is streamed into the cache and the cache file is scanned.
+        """
+        if not self.config.EXTRACT_CACHE:
+            return self.scan_csv(file_path, table_name)
+
+        lf = self.cache.get(table_name, file_path, lazy=True)
+        if lf is None:
+            lf = self.scan_csv(file_path, table_name)
+            if lf is not None:
+                self.cache.put(table_name, file_path, lf)
+                lf = self.cache.get(table_name, file_path, lazy=True)
+        return lf
+
+    def timed_extract_csv(self, file_path: str, table_name: str) -> Tuple[pl.DataFrame, float]:
+        """
+        Extract one CSV file and measure how long it took
+        Returns:
+            tuple: (DataFrame, elapsed seconds)
+        """
+        start = time.perf_counter()
+        df = self.read_table(file_path, table_name)
+        return df, time.perf_counter() - start
+
+    def extract_parallel(self, paths: Dict[str, str]) -> dict:
+        """
+        Extract the CSV files concurrently with a thread or process pool
+        The largest files are submitted first so they do not become the tail of the run.
+        Args:
+            paths: table name -> CSV path
+        Returns:
+            dict: table name -> DataFrame, in the same order as paths
+        """
+        config = self.config
+        executor_cls = ProcessPoolExecutor if config.EXTRACT_EXECUTOR == "process" else ThreadPoolExecutor
+        by_size = sorted(paths, key=lambda name: sum(os.path.getsize(f) for f in self.source_files(paths[name])),
+                         reverse=True)
+        logger.info(f"Extracting {len(paths)} tables with {config.EXTRACT_EXECUTOR} pool "
+                    f"({config.EXTRACT_MAX_WORKERS} workers), order: {by_size}")
+
+        results = {}
+        with executor_cls(max_workers=min(config.EXTRACT_MAX_WORKERS, len(paths))) as executor:
+            futures = {executor.submit(self.timed_extract_csv, paths[name], name): name for name in by_size}
+            for future in as_completed(futures):
+                name = futures[future]
+                pl_df, elapsed = future.result()
+                logger.info(f"⏱️ {name} extracted in {elapsed:.2f}s")
+                results[name] = pl_df
+
+        # คืนค่าตามลำดับเดิมของ Config.CSV_FILES
+        return {name: results[name] for name in paths}
+
+    def iter_csv_batches(self, file_path: str, table_name: str, batch_size: Optional[int] = None):
+        """
+        Stream a CSV file in row batches (batched mode)
+        Only one batch is held in memory at a time.
+        Yields:
+            pl.DataFrame: at most batch_size rows
+        """
+        batch_size = batch_size or self.config.BATCH_SIZE
+        lf = self.scan_csv(file_path, table_name)
+        for batch in lf.collect_batches(chunk_size=batch_size):
+            yield batch
+
+    def extract_data(self, skip_tables: Optional[list] = None) -> dict:
+        """
+        Read all source tables
+        Args:
+            skip_tables: tables not to read here (e.g. the ones streamed in batched mode)
+        """
 
         logger.info("📁 Reading the data from file CSVs...")
         try:
@@ -91,20 +402,27 @@ class DataExtractor:
             # ตรวจสอบว่าไฟล์ CSVs มีอยู่ในโฟลเดอร์ 
             paths = {}   
             for table_name, file_name in csv_files.items():
+                if skip_tables and table_name in skip_tables:
+                    continue
                 # file_path = os.path.join(datasource_dir, file_name)
                 file_path = config.get_csv_path(table_name)
                 
-                if os.path.exists(file_path):
+                if config.get_csv_paths(table_name):
                     paths[table_name] = file_path
                 else:
                     logger.warning(f"Error: cannot find '{file_name}' in the folder '{datasource_dir}'")
                     return None
-            dict_df = {}
-            for name, path in paths.items():
-                logger.info(f"Reading the data from {name} at {path}")
-                pl_df = self.extract_csv(path,name)
-                
-                dict_df[name] =  pl_df
+            if config.LAZY_MODE:
+                dict_df = {name: self.scan_table(path, name) for name, path in paths.items()}
+            elif config.EXTRACT_PARALLEL:
+                dict_df = self.extract_parallel(paths)
+            else:
+                dict_df = {}
+                for name, path in paths.items():
+                    logger.info(f"Reading the data from {name} at {path}")
+                    pl_df, elapsed = self.timed_extract_csv(path, name)
+                    logger.info(f"⏱️ {name} extracted in {elapsed:.2f}s")
+                    dict_df[name] =  pl_df
                 
                     
             # dict_df = {name: extract_csv(path,name) for name, path in paths.items()}
@@ -1,38 +1,129 @@
 import duckdb as dd
 import polars as pl
 from typing import Dict, List, Optional
+import json
 import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 from src.config import Config
+from src.database import ConnectionManager
 
 # Setup logging
 logging.basicConfig(level=getattr(logging, Config.LOG_LEVEL))
 logger = logging.getLogger(__name__)
 
+# Polars dtype -> DuckDB type สำหรับ read_csv ของ DuckDB-native path
+DUCKDB_TYPES = {
+    pl.Int8: "TINYINT",
+    pl.Int16: "SMALLINT",
+    pl.Int32: "INTEGER",
+    pl.Int64: "BIGINT",
+    pl.Float32: "FLOAT",
+    pl.Float64: "DOUBLE",
+    pl.String: "VARCHAR",
+    pl.Categorical: "VARCHAR",
+    pl.Date: "DATE",
+    pl.Boolean: "BOOLEAN",
+}
+
+# SCD Type 2 dimensions: table -> natural key (ดูว่าเปิดใช้ตารางไหนจาก Config.SCD2_TABLES)
+SCD2_KEYS = {
+    "dim_customers": "customer_id",
+    "dim_products": "product_id",
+    "dim_staffs": "staff_id",
+    "dim_stores": "store_id",
+}
+# version แรกของ key ใช้ได้ย้อนหลังทั้งหมด (order เก่ายัง join เจอ); version ปัจจุบันเปิดถึง SCD2_END
+SCD2_BEGIN = "TIMESTAMP '1900-01-01'"
+SCD2_END = "TIMESTAMP '9999-12-31'"
+
+# Sales cubes built from fact_sales: table -> (period column, period expression, grouping keys)
+# period expression รับคอลัมน์/พารามิเตอร์วันที่ผ่าน {col}
+AGGREGATE_TABLES = {
+    "agg_sales_daily": ("sales_date", "{col}", ["store_id", "product_id", "staff_id"]),
+    "agg_sales_monthly": ("sales_month", "CAST(date_trunc('month', {col}) AS DATE)", ["store_id", "product_id"]),
+    "agg_sales_monthly_staff": ("sales_month", "CAST(date_trunc('month', {col}) AS DATE)", ["store_id", "staff_id"]),
+}
+
+# Measures ของทุก cube; customer_ids เป็น sketch แบบ exact ที่ merge ได้ (DuckDB ไม่มี HLL ที่ merge ข้าม grain ได้)
+# count(DISTINCT) ของช่วงที่ใหญ่กว่าให้ใช้ list_distinct(flatten(list(customer_ids)))
+AGGREGATE_MEASURES = """
+    sum(net_amount) AS net_sales,
+    sum(gross_amount) AS gross_sales,
+    sum(discount_amount) AS discount_amount,
+    sum(quantity) AS quantity,
+    count(*) AS line_count,
+    count(DISTINCT order_id) AS order_count,
+    count(DISTINCT customer_id) AS customer_count,
+    list_sort(list(DISTINCT customer_id)) AS customer_ids
+"""
+
+# Date column of each fact: year=/month= of its Hive-partitioned Parquet mirror
+# (Config.PARTITIONED_FACTS) and the row order of its lake export
+PARTITION_DATES = {
+    "fact_sales": "order_date",
+    "fact_inventory_snapshot": "snapshot_date",
+}
+
+# Post-load layout (optimize_warehouse): facts rewritten in this order so the zone maps
+# (min/max ต่อ row group) ตัด row group ที่อยู่นอกช่วงวันที่/สาขาที่กรองทิ้งได้
+OPTIMIZE_SORT = {
+    "fact_sales": ["order_date", "store_id"],
+}
+# ART indexes on the common lookup keys (primary keys have one already)
+OPTIMIZE_INDEXES = {
+    "fact_sales": ["customer_id", "product_id", "order_date"],
+    "agg_customer": ["customer_id"],
+}
+
+# Customer metrics (agg_customer): lifetime measures ต่อ customer_id จาก fact_sales
+CUSTOMER_MEASURES = """
+    min(order_date) AS first_order_date,
+    max(order_date) AS last_order_date,
+    CAST(count(DISTINCT order_id) AS INTEGER) AS order_count,
+    CAST(sum(quantity) AS INTEGER) AS quantity,
+    sum(net_amount) AS lifetime_net_sales,
+    sum(net_amount) / count(DISTINCT order_id) AS avg_order_value,
+    count(DISTINCT order_id) > 1 AS is_repeat
+"""
+
+# RFM scores 1-5 (5 = ดีที่สุด) จาก cume_dist: ค่าที่เท่ากันได้คะแนนเท่ากัน ผลจึงไม่ขึ้นกับลำดับแถว
+# recency นับจาก order ล่าสุดในคลัง (ไม่ใช่วันนี้) ข้อมูลย้อนหลังจึงยังแบ่งกลุ่มได้
+CUSTOMER_SCORES = """
+    SELECT customer_id,
+           CAST(max(last_order_date) OVER () - last_order_date AS INTEGER) AS recency_days,
+           CAST(ceil(5 * cume_dist() OVER (ORDER BY last_order_date)) AS TINYINT) AS recency_score,
+           CAST(ceil(5 * cume_dist() OVER (ORDER BY order_count)) AS TINYINT) AS frequency_score,
+           CAST(ceil(5 * cume_dist() OVER (ORDER BY lifetime_net_sales)) AS TINYINT) AS monetary_score
+    FROM agg_customer
+"""
+
 class DataLoader:
     """Class for loading data into DuckDB data warehouse"""
     
     def __init__(self):
         self.config = Config()
-        self.db_path = self.config.DATABASE_PATH
+        self.db_path = self.config.get_database_path()
         self.connection = None
+        # Blue/green: version file being built in this run (see begin_build)
+        self.build_path = None
+        # True while a caller holds an open transaction on self.connection (see transaction)
+        self.in_transaction = False
 
     def connect(self) -> dd.DuckDBPyConnection:
         """
-        Create connection to DuckDB database
+        Get the shared read-write connection to the DuckDB database
         
         Returns:
             DuckDB connection object
         """
         try:
-            # Ensure database directory exists
-            df_path = Path(self.db_path)
-            if not df_path.parent.exists():
-                self.db_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            
-            # Create connection
-            self.connection =dd.connect(self.db_path)
+            # ConnectionManager สร้าง directory ของไฟล์ให้และเปิด connection ครั้งเดียวต่อ process
+            self.connection = ConnectionManager.shared(self.db_path).connect_writer()
             logger.info(f"Connected to DuckDB at {self.db_path}")
             return self.connection
             
@@ -40,14 +131,256 @@ class DataLoader:
             logger.error(f"Error connecting to database: {str(e)}")
             raise
 
-    def disconnect(self):
-        """Close database connection"""
+    def disconnect(self, close: bool = False):
+        """
+        Release the database connection
+        Args:
+            close: also close the shared read-write connection, checkpointing the file
+                (before it is copied, published or removed)
+        """
         if self.connection:
-            self.connection.close()
-            logger.info("Database connection closed")
+            self.connection = None
+            logger.info("Database connection released")
+        if close:
+            ConnectionManager.close_shared(self.db_path)
     
-    def create_schema(self):
-        """Create database schema for data warehouse"""
+    def published_versions(self) -> List[Path]:
+        """Version files of the warehouse (blue/green), oldest first"""
+        base = Path(self.config.DATABASE_PATH)
+        return sorted(base.parent.glob(f"{base.stem}.v*{base.suffix}"))
+
+    def begin_build(self):
+        """
+        Blue/green: start a new warehouse version as a copy of the published one
+        Every later connect() of this loader writes to the copy; readers keep using the
+        published file until publish() switches them over.
+        """
+        self.disconnect(close=True)
+        base = Path(self.config.DATABASE_PATH)
+        base.parent.mkdir(parents=True, exist_ok=True)
+        build = base.parent / f"{base.stem}.v{datetime.now():%Y%m%dT%H%M%S%f}{base.suffix}"
+        # version ที่ publish แล้ว (หรือไฟล์เดิมก่อนเปิด blue/green) ต้องคัดลอกมาด้วย:
+        # incremental load, SCD2 และ snapshot ต้องใช้ state ของ run ก่อน
+        published = Path(self.config.get_database_path())
+        if published.exists():
+            shutil.copyfile(published, build)
+            wal = Path(f"{published}.wal")
+            if wal.exists():
+                shutil.copyfile(wal, f"{build}.wal")
+        # partition ของ version ใหม่เริ่มจาก hard link ของ version ที่ publish: เขียนทับเมื่อไหร่
+        # ก็สร้างไฟล์ใหม่ ไฟล์ที่ reader ของ version เดิมใช้อยู่ไม่ถูกแก้
+        for table_name in PARTITION_DATES:
+            source = self.version_dir(self.config.PARTITION_DIR, published) / table_name
+            if source.exists():
+                shutil.copytree(source, self.version_dir(self.config.PARTITION_DIR, build) / table_name,
+                                copy_function=os.link)
+        self.build_path = build
+        self.db_path = str(build)
+        logger.info(f"Building warehouse version {build.name} (published: {published.name})")
+
+    def publish(self) -> bool:
+        """
+        Blue/green: make the version built in this run the one readers open
+        The pointer file is replaced atomically; older versions beyond
+        Config.PUBLISH_KEEP_VERSIONS are removed.
+        """
+        if self.build_path is None:
+            return True
+        try:
+            self.disconnect(close=True)
+            history = self.publish_history()
+            # lake สลับก่อน pointer: ถ้าล้มเหลว reader ยังอยู่ที่ version เดิมทั้งคู่
+            if self.config.EXPORT_LAKE and not self.publish_lake(self.build_path):
+                return False
+            self.write_pointer(self.build_path.name)
+            self.write_history(history + [self.history_entry(self.build_path.name, "publish")])
+            logger.info(f"📢 Published warehouse version {self.build_path.name}")
+            self.build_path = None
+            self.prune_versions()
+            return True
+        except Exception as e:
+            logger.error(f"Error publishing warehouse version: {str(e)}")
+            return False
+
+    def discard_build(self):
+        """Blue/green: drop an unpublished build; readers stay on the published version"""
+        if self.build_path is None:
+            return
+        self.disconnect(close=True)
+        for path in (self.build_path, Path(f"{self.build_path}.wal")):
+            if path.exists():
+                path.unlink()
+        for root in (self.config.PARTITION_DIR, self.config.LAKE_DIR):
+            shutil.rmtree(self.version_dir(root, self.build_path), ignore_errors=True)
+        logger.info(f"Discarded unpublished warehouse version {self.build_path.name}")
+        self.build_path = None
+        self.db_path = self.config.get_database_path()
+
+    def rollback_publish(self) -> bool:
+        """
+        Blue/green: point readers back to the version that was live before the current one
+        The current version is recorded as rolled back from and is never chosen again.
+        With Config.EXPORT_LAKE the Parquet lake is switched back too; without a lake for
+        that version the rollback is refused.
+        """
+        current = Path(self.config.get_database_path()).name
+        history = self.publish_history()
+        older = [version for version in self.good_versions(history) if version != current]
+        if not older:
+            logger.error("No previous warehouse version to roll back to")
+            return False
+        target = Path(self.config.DATABASE_PATH).parent / older[0]
+        if self.config.EXPORT_LAKE and not self.publish_lake(target):
+            logger.error(f"Rollback to {older[0]} aborted; readers stay on {current}")
+            return False
+        self.write_pointer(older[0])
+        self.write_history(history + [self.history_entry(older[0], "rollback", rolled_back_from=current)])
+        logger.info(f"⏪ Rolled back from {current} to {older[0]}")
+        return True
+
+    def history_entry(self, version: str, action: str, **extra) -> dict:
+        """One record of the publish history"""
+        return {"version": version, "action": action,
+                "at": datetime.now().isoformat(timespec="seconds"), **extra}
+
+    def publish_history(self) -> List[dict]:
+        """
+        Publish / rollback records of Config.PUBLISH_HISTORY, oldest first
+        Without a history file (versions published before it existed) the versions up to
+        the published one are taken in name order.
+        """
+        path = Path(self.config.PUBLISH_HISTORY)
+        if path.exists():
+            return json.loads(path.read_text(encoding="utf-8"))
+        current = Path(self.config.get_database_path()).name
+        return [self.history_entry(version.name, "publish")
+                for version in self.published_versions() if version.name <= current]
+
+    def write_history(self, history: List[dict]):
+        """Replace the publish history atomically"""
+        path = Path(self.config.PUBLISH_HISTORY)
+        temp = path.with_name(path.name + ".tmp")
+        temp.write_text(json.dumps(history, indent=2), encoding="utf-8")
+        os.replace(temp, path)
+
+    def good_versions(self, history: List[dict]) -> List[str]:
+        """
+        Versions that were live and never rolled back from, most recently live first,
+        limited to files still on disk
+        """
+        bad = {entry["rolled_back_from"] for entry in history if "rolled_back_from" in entry}
+        on_disk = {path.name for path in self.published_versions()}
+        versions = []
+        for entry in reversed(history):
+            version = entry["version"]
+            if version in on_disk and version not in bad and version not in versions:
+                versions.append(version)
+        return versions
+
+    def write_pointer(self, version: str):
+        """Replace the publish pointer atomically (write a temp file, then rename)"""
+        pointer = Path(self.config.PUBLISH_POINTER)
+        temp = pointer.with_name(pointer.name + ".tmp")
+        temp.write_text(version, encoding="utf-8")
+        os.replace(temp, pointer)
+
+    def prune_versions(self):
+        """
+        Keep the live version plus the last good ones of the publish history, up to
+        Config.PUBLISH_KEEP_VERSIONS, and remove the other published versions
+        Versions rolled back from go first; files newer than the live one that were never
+        published (a build in progress) are left alone.
+        """
+        current = Path(self.config.get_database_path()).name
+        history = self.publish_history()
+        keep = [current] + [version for version in self.good_versions(history) if version != current]
+        keep = keep[:max(1, self.config.PUBLISH_KEEP_VERSIONS)]
+        published = {entry["version"] for entry in history}
+        versions = [path for path in self.published_versions()
+                    if path.name not in keep and (path.name in published or path.name < current)]
+        manifest = Path(self.config.LAKE_DIR) / "manifest.json"
+        lake_version = json.loads(manifest.read_text(encoding="utf-8")).get("version") if manifest.exists() else None
+        for path in versions:
+            try:
+                path.unlink()
+                shutil.rmtree(self.version_dir(self.config.PARTITION_DIR, path), ignore_errors=True)
+                # lake ที่ publish อยู่ (รอบหลังอาจไม่ได้ export) ต้องคงไว้
+                if path.stem != lake_version:
+                    shutil.rmtree(self.version_dir(self.config.LAKE_DIR, path), ignore_errors=True)
+                logger.info(f"Removed old warehouse version {path.name}")
+            except OSError as e:
+                # Windows: ไฟล์ที่ reader ยังเปิดอยู่ลบไม่ได้ รอบหน้าจะลองใหม่
+                logger.warning(f"Could not remove {path.name}: {str(e)}")
+
+    def version_dir(self, root: str, db_path=None) -> Path:
+        """
+        Directory under root (Config.PARTITION_DIR / LAKE_DIR) for the files of a warehouse
+        version: <root>/<version> under BLUE_GREEN, so readers of a published version never
+        see files of a later build; root itself for DATABASE_PATH
+        Args:
+            db_path: database file of the version; default the one this loader writes
+        """
+        db_path = Path(db_path or self.db_path)
+        if self.config.BLUE_GREEN and db_path != Path(self.config.DATABASE_PATH):
+            return Path(root) / db_path.stem
+        return Path(root)
+
+    def publish_lake(self, build: Path) -> bool:
+        """
+        Blue/green: switch LAKE_DIR/lake.duckdb and manifest.json to the lake of a version
+        Returns:
+            bool: False if the version has no exported lake or the files could not be replaced
+        """
+        lake = self.version_dir(self.config.LAKE_DIR, build)
+        root = Path(self.config.LAKE_DIR)
+        if not all((lake / name).exists() for name in ("lake.duckdb", "manifest.json")):
+            logger.error(f"No Parquet lake exported for {build.name} in {lake}")
+            return False
+        try:
+            for name in ("lake.duckdb", "manifest.json"):
+                temp = root / f"{name}.tmp"
+                shutil.copyfile(lake / name, temp)
+                os.replace(temp, root / name)
+        except OSError as e:
+            logger.error(f"Error switching the Parquet lake to {build.name}: {str(e)}")
+            return False
+        logger.info(f"Published the Parquet lake of {build.name}")
+        return True
+
+    def swap_dir(self, stage: Path, target: Path):
+        """Replace the directory target with stage by two renames; the old one is removed after"""
+        old = target.with_name(target.name + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if target.exists():
+            os.replace(target, old)
+        os.replace(stage, target)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block in one transaction
+        Inside a transaction the caller already opened (in_transaction) the block
+        simply joins it; the caller commits or rolls back.
+        """
+        if self.in_transaction:
+            yield
+            return
+        self.connection.execute("BEGIN TRANSACTION")
+        try:
+            yield
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def create_schema(self, tables: Optional[List[str]] = None, exclude: Optional[List[str]] = None):
+        """
+        Create database schema for data warehouse
+        Args:
+            tables: only (re)create these tables; None re-creates every table
+            exclude: tables to leave untouched
+        """
         logger.info("Creating database schema")
         
         if not self.connection:
@@ -58,10 +391,10 @@ class DataLoader:
             # self.connection.execute("CREATE SCHEMA IF NOT EXISTS fact")
             
             # Create dimension tables
-            self.create_dimension_tables()
+            self.create_dimension_tables(tables, exclude)
             
             # Create fact tables
-            self.create_fact_tables()
+            self.create_fact_tables(tables, exclude)
             
             logger.info("Database schema created successfully")
             
@@ -69,125 +402,185 @@ class DataLoader:
             logger.error(f"Error creating schema: {str(e)}")
             raise
 
-    def create_dimension_tables(self):
+    def execute_ddl(self, ddl: Dict[str, str], tables: Optional[List[str]] = None,
+                    exclude: Optional[List[str]] = None):
+        """Run the CREATE statements in ddl (table name -> statement), limited to tables if given"""
+        for name, statement in ddl.items():
+            if (tables is None or name in tables) and not (exclude and name in exclude):
+                self.connection.execute(statement)
+
+    def create_dimension_tables(self, tables: Optional[List[str]] = None, exclude: Optional[List[str]] = None):
         """Create dimension tables (BikeStores)"""
+        self.execute_ddl(self.dimension_ddl(), tables, exclude)
 
-        # 1) Date dimension (ใช้ DATE เป็น key ให้ join กับ fact ได้ตรงๆ)
-        self.connection.execute("""
-            CREATE OR REPLACE TABLE dim_date (
-                date_key DATE PRIMARY KEY,
+    def create_fact_tables(self, tables: Optional[List[str]] = None, exclude: Optional[List[str]] = None):
+        """Create fact tables (BikeStores)"""
+        self.execute_ddl(self.fact_ddl(), tables, exclude)
+
+    def typed_tables(self) -> List[str]:
+        """Tables that have a DDL in create_schema"""
+        return list(self.dimension_ddl()) + list(self.fact_ddl())
+
+    def dimension_keys(self, table_name: str, key: str) -> str:
+        """
+        Primary key clause of a dimension DDL
+        SCD2 dimensions keep one row per version, so they also get the history
+        columns of scd2_merge and the key becomes (key, valid_from).
+        """
+        if not self.scd2_key(table_name):
+            return f"PRIMARY KEY ({key})"
+        return f"""row_hash UHUGEINT,
+                valid_from TIMESTAMP,
+                valid_to TIMESTAMP,
+                is_current BOOLEAN,
+                PRIMARY KEY ({key}, valid_from)"""
+
+    def dimension_ddl(self) -> Dict[str, str]:
+        """CREATE statements of the dimension tables, table name -> statement"""
+        ddl = {}
+
+        # 1) Date dimension (key = YYYYMMDD แบบ INTEGER; fact อ้างถึงด้วย *_date_key)
+        # สร้างครั้งเดียวแล้วขยายช่วงวันที่เพิ่ม (ETLPipeline.run_date_dimension) จึงไม่ REPLACE
+        ddl["dim_date"] = """
+            CREATE TABLE IF NOT EXISTS dim_date (
+                date_key INTEGER PRIMARY KEY,
                 date DATE,
                 year INTEGER,
-                quarter INTEGER,
-                month INTEGER,
-                month_name VARCHAR,
-                day INTEGER,
-                day_of_week INTEGER,      -- Monday=0 ... Sunday=6
-                day_name VARCHAR,
-                week_of_year INTEGER,
+                quarter TINYINT,
+                month TINYINT,
+                month_name ENUM('January', 'February', 'March', 'April', 'May', 'June', 'July',
+                                'August', 'September', 'October', 'November', 'December'),
+                day TINYINT,
+                day_of_week TINYINT,      -- Monday=1 ... Sunday=7
+                day_name ENUM('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'),
+                week_of_year TINYINT,
                 is_weekend BOOLEAN,
-                fiscal_quarter INTEGER
+                fiscal_quarter TINYINT,
+                month_label VARCHAR,      -- '2018-03'
+                quarter_label VARCHAR     -- '2018Q1'
             )
-        """)
+        """
 
-        # 2) Customers
-        self.connection.execute("""
+        # 2) Customers (ชื่อคอลัมน์ตรงกับ DataTransformer เพื่อให้ INSERT BY NAME ได้)
+        ddl["dim_customers"] = f"""
             CREATE OR REPLACE TABLE dim_customers (
-                customer_id INTEGER PRIMARY KEY,
-                first_name VARCHAR,
-                last_name VARCHAR,
-                full_name VARCHAR,
-                email VARCHAR,
+                customer_id INTEGER,
+                customer_firstname VARCHAR,
+                customer_lastname VARCHAR,
                 customer_phone VARCHAR,
-                street VARCHAR,
-                city VARCHAR,
-                state VARCHAR,
-                postal_code VARCHAR
+                customer_email VARCHAR,
+                customer_street VARCHAR,
+                customer_city VARCHAR,
+                customer_state VARCHAR,
+                customer_zipcode VARCHAR,
+                customer_fullname VARCHAR,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                {self.dimension_keys("dim_customers", "customer_id")}
             )
-        """)
+        """
 
         # 3) Brands
-        self.connection.execute("""
+        ddl["dim_brands"] = f"""
             CREATE OR REPLACE TABLE dim_brands (
-                brand_id INTEGER PRIMARY KEY,
-                brand_name VARCHAR
+                brand_id SMALLINT,
+                brand_name VARCHAR,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                {self.dimension_keys("dim_brands", "brand_id")}
             )
-        """)
+        """
 
         # 4) Categories
-        self.connection.execute("""
+        ddl["dim_categories"] = f"""
             CREATE OR REPLACE TABLE dim_categories (
-                category_id INTEGER PRIMARY KEY,
-                category_name VARCHAR
+                category_id SMALLINT,
+                category_name VARCHAR,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                {self.dimension_keys("dim_categories", "category_id")}
             )
-        """)
+        """
 
         # 5) Products
-        self.connection.execute("""
+        ddl["dim_products"] = f"""
             CREATE OR REPLACE TABLE dim_products (
-                product_id INTEGER PRIMARY KEY,
+                product_id INTEGER,
                 product_name VARCHAR,
-                brand_id INTEGER,
-                category_id INTEGER,
-                model_year INTEGER,
-                list_price DECIMAL(10,2)
+                brand_id SMALLINT,
+                category_id SMALLINT,
+                model_year SMALLINT,
+                list_price DECIMAL(10,2),
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                {self.dimension_keys("dim_products", "product_id")}
             )
-        """)
+        """
 
         # 6) Stores
-        self.connection.execute("""
+        ddl["dim_stores"] = f"""
             CREATE OR REPLACE TABLE dim_stores (
-                store_id INTEGER PRIMARY KEY,
+                store_id SMALLINT,
                 store_name VARCHAR,
-                phone VARCHAR,
-                email VARCHAR,
-                street VARCHAR,
-                city VARCHAR,
-                state VARCHAR,
-                postal_code VARCHAR
+                store_phone VARCHAR,
+                store_email VARCHAR,
+                store_street VARCHAR,
+                store_city VARCHAR,
+                store_state VARCHAR,
+                store_zip_code VARCHAR,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                {self.dimension_keys("dim_stores", "store_id")}
             )
-        """)
+        """
 
         # 7) Staffs แก้ใน transform
-        self.connection.execute("""
+        ddl["dim_staffs"] = f"""
             CREATE OR REPLACE TABLE dim_staffs (
-                staff_id INTEGER PRIMARY KEY,
-                first_name VARCHAR,
-                last_name VARCHAR,
-                full_name VARCHAR,
-                email VARCHAR,
-                phone VARCHAR,
-                active BOOLEAN,
-                store_id INTEGER,
-                manager_id INTEGER
+                staff_id SMALLINT,
+                staff_firstname VARCHAR,
+                staff_lastname VARCHAR,
+                staff_email VARCHAR,
+                staff_phone VARCHAR,
+                staff_active BOOLEAN,
+                store_id SMALLINT,
+                manager_id SMALLINT,
+                staff_fullname VARCHAR,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                {self.dimension_keys("dim_staffs", "staff_id")}
             )
-        """)
+        """
 
         # 8) Order Status (static mapping)
-        self.connection.execute("""
+        ddl["dim_order_status"] = """
             CREATE OR REPLACE TABLE dim_order_status (
                 order_status_id INTEGER PRIMARY KEY,
                 order_status_name VARCHAR
             )
-        """)
+        """
+        return ddl
 
-    def create_fact_tables(self):
-        """Create fact tables (BikeStores)"""
+    def fact_ddl(self) -> Dict[str, str]:
+        """CREATE statements of the fact tables, table name -> statement"""
+        ddl = {}
 
         # Fact Sales (grain = order line)
-        self.connection.execute("""
+        ddl["fact_sales"] = """
             CREATE OR REPLACE TABLE fact_sales (
                 order_id INTEGER,
-                item_id INTEGER,
+                item_id SMALLINT,
                 customer_id INTEGER,
-                store_id INTEGER,
-                staff_id INTEGER,
+                store_id SMALLINT,
+                staff_id SMALLINT,
                 product_id INTEGER,
-                order_status_id INTEGER,
+                order_status_id TINYINT,
 
-                order_date_key DATE,
-                required_date_key DATE,
-                shipped_date_key DATE,
+                order_date_key INTEGER,         -- dim_date.date_key (YYYYMMDD)
+                required_date_key INTEGER,
+                shipped_date_key INTEGER,
+                order_date DATE,
+                shipped_date DATE,
 
                 quantity INTEGER,
                 list_price DECIMAL(10,2),
@@ -200,62 +593,804 @@ class DataLoader:
                 shipped_on_time BOOLEAN,
 
                 discount_pct DECIMAL(5,2),      -- 0..100
-                discount_bucket VARCHAR,
+                discount_bucket ENUM('0-10%', '10-20%', '>20%'),
 
                 created_at TIMESTAMP,
+                updated_at TIMESTAMP,
 
                 PRIMARY KEY (order_id, item_id)
             )
-        """)
+        """
 
         # Fact Inventory (current stock per store-product)
-        self.connection.execute("""
+        ddl["fact_inventory"] = """
             CREATE OR REPLACE TABLE fact_inventory (
-                store_id INTEGER,
+                store_id SMALLINT,
                 product_id INTEGER,
                 quantity_on_hand INTEGER,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
                 PRIMARY KEY (store_id, product_id)
             )
-        """)
+        """
 
-    def load_dataframe(self, df: pl.DataFrame, table_name: str) -> bool:
+        # Inventory history: เก็บเฉพาะวันที่ quantity เปลี่ยน (delta) ไม่ใช่ทุกวัน x store x product
+        # ประวัติต้องอยู่ข้าม run จึงไม่ REPLACE; ดูตำแหน่งรายวันได้จาก view inventory_daily_position
+        ddl["fact_inventory_snapshot"] = """
+            CREATE TABLE IF NOT EXISTS fact_inventory_snapshot (
+                snapshot_date DATE,
+                store_id SMALLINT,
+                product_id INTEGER,
+                quantity_on_hand INTEGER,       -- position from snapshot_date on
+                quantity_change INTEGER,        -- vs. the previous recorded position
+                PRIMARY KEY (snapshot_date, store_id, product_id)
+            )
         """
-        Load Polars DataFrame into DuckDB table (replace mode)
+        return ddl
+
+    def load_dataframe(self, df: pl.DataFrame, table_name: str, mode: str = "replace",
+                       keys: Optional[List[str]] = None, expire_missing: bool = True) -> bool:
+        """
+        Load Polars DataFrame into DuckDB table
+        Args:
+            mode: "replace" (re-create the table from df), "upsert" (replace the rows whose keys
+                appear in df), "scd2" (see scd2_merge), or "append" / "truncate" / "merge"
+                into the existing typed table (see insert_from)
+            keys: key columns for "upsert" / "scd2"
+            expire_missing: "scd2" only; False when df is a single batch of the source
         """
         try:
             if not self.connection:
                 self.connect()
 
             arrow_table = df.to_arrow()
-            self.connection.register("temp_table", arrow_table)
+            columns = self.select_columns(df)
+            # ชื่อ registration ต่อตาราง: โหลดหลายตารางพร้อมกันได้โดยไม่ชนกัน
+            temp_name = f"temp_{table_name}"
+            self.connection.register(temp_name, arrow_table)
 
             # Insert data into target table
-            full_table_name = f"{table_name}"
-            # หมายเหตุ: คำสั่งนี้จะ "แทนที่" ตารางเดิมด้วย schema ของ df
-            # หากต้องการบังคับ schema ให้ตรงตาม DDL ให้ใช้ INSERT INTO ... SELECT ... และคอลัมน์ให้ครบถ้วน
-            self.connection.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM temp_table")
+            # หมายเหตุ: "replace" จะแทนที่ตารางเดิมด้วย schema ของ df ส่วน append/truncate/merge คง DDL ไว้
+            if mode in ("append", "truncate", "merge"):
+                self.insert_from(table_name, temp_name, mode)
+            elif mode == "upsert":
+                self.upsert_from(table_name, temp_name, keys)
+            elif mode == "scd2":
+                self.scd2_merge(table_name, temp_name, keys[0], expire_missing)
+            else:
+                self.connection.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT {columns} FROM {temp_name}")
 
-            self.connection.unregister("temp_table")
-            logger.info(f"Successfully loaded {len(df)} rows into {table_name}")
+            self.connection.unregister(temp_name)
+            logger.info(f"Successfully loaded {len(df)} rows into {table_name} ({mode})")
             return True
         except Exception as e:
             logger.error(f"Error loading data into {table_name}: {str(e)}")
             return False
 
-    def load_all_data(self, transformed_data: Dict[str, pl.DataFrame]) -> bool:
+    def replace_mode(self, table_name: str) -> str:
+        """
+        Mode for rebuilding a whole table: "truncate" keeps the typed DDL table
+        (Config.TYPED_LOAD), "replace" re-creates it from the data
+        """
+        if self.config.TYPED_LOAD and table_name in self.typed_tables():
+            return "truncate"
+        return "replace"
+
+    def insert_from(self, table_name: str, source: str, mode: str = "append"):
+        """
+        Insert source into the typed table_name by column name (types come from the DDL)
+        Args:
+            source: table/view name or a parenthesized query
+            mode: "append", "truncate" (empty the table first, in the same transaction)
+                or "merge" (INSERT OR REPLACE on the primary key)
+        """
+        if table_name not in self.existing_tables():
+            self.create_schema([table_name])
+        verb = "INSERT OR REPLACE" if mode == "merge" else "INSERT"
+        with self.transaction():
+            if mode == "truncate":
+                self.connection.execute(f"TRUNCATE {table_name}")
+            self.connection.execute(f"{verb} INTO {table_name} BY NAME SELECT * FROM {source}")
+
+    def select_columns(self, df: pl.DataFrame) -> str:
+        """
+        SELECT list for creating a table from df: pl.Enum columns become DuckDB ENUM
+        (Categorical has an open set of values and stays VARCHAR, which DuckDB dictionary-compresses)
+        """
+        columns = []
+        for name, dtype in df.schema.items():
+            if isinstance(dtype, pl.Enum):
+                values = ", ".join("'" + value.replace("'", "''") + "'" for value in dtype.categories.to_list())
+                columns.append(f'CAST("{name}" AS ENUM({values})) AS "{name}"')
+            else:
+                columns.append(f'"{name}"')
+        return ", ".join(columns)
+
+    def upsert_from(self, table_name: str, source: str, keys: List[str]):
+        """
+        Replace the rows of table_name whose keys appear in source, in one transaction
+        Every existing row of a key is deleted first, so lines removed from a
+        changed order disappear as well.
+        """
+        match = " AND ".join(f"src.{key} = {table_name}.{key}" for key in keys)
+        with self.transaction():
+            self.connection.execute(
+                f"DELETE FROM {table_name} WHERE EXISTS (SELECT 1 FROM {source} src WHERE {match})"
+            )
+            self.connection.execute(f"INSERT INTO {table_name} BY NAME SELECT * FROM {source}")
+
+    def scd2_key(self, table_name: str) -> Optional[str]:
+        """Natural key of table_name if it is kept as an SCD Type 2 dimension, otherwise None"""
+        if table_name in self.config.SCD2_TABLES:
+            return SCD2_KEYS.get(table_name)
+        return None
+
+    def scd2_merge(self, table_name: str, source: str, key: str, expire_missing: bool = True):
+        """
+        Merge a dimension snapshot into an SCD Type 2 table (valid_from / valid_to / is_current)
+        Every row gets a row_hash of its tracked attributes (all columns except the key and
+        audit columns). Only keys whose hash differs from the current version are expired
+        and re-inserted; unchanged rows are not touched. Both steps are set-based joins.
+        Args:
+            source: table/view with the new snapshot
+            key: natural key column
+            expire_missing: also expire current rows whose key is not in source
+        """
+        columns = [row[0] for row in self.connection.execute(f"DESCRIBE {source}").fetchall()]
+        tracked = [col for col in columns if col not in (key, "created_at", "updated_at")]
+        # md5 ของข้อความ struct คงที่ข้ามเวอร์ชัน DuckDB (ต่างจาก hash())
+        row_hash = f"md5_number(CAST(struct_pack({', '.join(tracked)}) AS VARCHAR))"
+
+        existing = [row[0] for row in self.connection.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = 'main' AND table_name = ?", [table_name]
+        ).fetchall()]
+        if "row_hash" not in existing:
+            self.connection.execute(f"""
+                CREATE OR REPLACE TABLE {table_name} AS
+                SELECT *, {row_hash} AS row_hash,
+                       {SCD2_BEGIN} AS valid_from, {SCD2_END} AS valid_to, true AS is_current
+                FROM {source}
+            """)
+            logger.info(f"Created SCD2 table {table_name}")
+            return
+
+        with self.transaction():
+            self.connection.execute(
+                f"CREATE OR REPLACE TEMP TABLE scd_source AS SELECT *, {row_hash} AS row_hash FROM {source}"
+            )
+            expire = f"EXISTS (SELECT 1 FROM scd_source s WHERE s.{key} = t.{key} AND s.row_hash <> t.row_hash)"
+            if expire_missing:
+                expire += f" OR NOT EXISTS (SELECT 1 FROM scd_source s WHERE s.{key} = t.{key})"
+            expired = self.connection.execute(f"""
+                UPDATE {table_name} t SET valid_to = localtimestamp, is_current = false, updated_at = localtimestamp
+                WHERE t.is_current AND ({expire})
+            """).fetchone()[0]
+            # key ใหม่ได้ version แรกแบบย้อนหลัง, key ที่เปลี่ยนได้ version ใหม่ตั้งแต่ run นี้
+            inserted = self.connection.execute(f"""
+                INSERT INTO {table_name} BY NAME
+                SELECT s.*,
+                       CASE WHEN EXISTS (SELECT 1 FROM {table_name} o WHERE o.{key} = s.{key})
+                            THEN localtimestamp ELSE {SCD2_BEGIN} END AS valid_from,
+                       {SCD2_END} AS valid_to, true AS is_current
+                FROM scd_source s
+                WHERE NOT EXISTS (SELECT 1 FROM {table_name} c WHERE c.is_current AND c.{key} = s.{key})
+            """).fetchone()[0]
+            self.connection.execute("DROP TABLE scd_source")
+        logger.info(f"SCD2 merge into {table_name}: {expired} versions expired, {inserted} inserted")
+
+    def delete_keys(self, table_name: str, df: pl.DataFrame) -> bool:
+        """Delete the rows of table_name whose key columns match a row of df"""
+        try:
+            if not self.connection:
+                self.connect()
+            self.connection.register("temp_keys", df.to_arrow())
+            match = " AND ".join(f"k.{key} = {table_name}.{key}" for key in df.columns)
+            self.connection.execute(f"DELETE FROM {table_name} WHERE EXISTS (SELECT 1 FROM temp_keys k WHERE {match})")
+            self.connection.unregister("temp_keys")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting keys from {table_name}: {str(e)}")
+            return False
+
+    def get_watermark(self, table_name: str = "fact_sales") -> Optional[tuple]:
+        """
+        High-water mark recorded by the last load of a fact
+        Returns:
+            tuple: (max_order_id, max_order_date), or None if there is no loaded fact yet
+        """
+        if not self.connection:
+            self.connect()
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS etl_watermark (
+                table_name VARCHAR PRIMARY KEY,
+                max_order_id INTEGER,
+                max_order_date DATE,
+                updated_at TIMESTAMP
+            )
+        """)
+        if table_name not in self.existing_tables():
+            return None
+        row = self.connection.execute(
+            "SELECT max_order_id, max_order_date FROM etl_watermark WHERE table_name = ?", [table_name]
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row
+
+    def update_watermark(self, table_name: str = "fact_sales"):
+        """Record max(order_id) / max(order_date) of the loaded fact"""
+        if not self.connection:
+            self.connect()
+        self.get_watermark(table_name)
+        self.connection.execute(f"""
+            INSERT OR REPLACE INTO etl_watermark
+            SELECT ?, max(order_id), max(order_date), localtimestamp FROM {table_name}
+        """, [table_name])
+        row = self.connection.execute(
+            "SELECT max_order_id, max_order_date FROM etl_watermark WHERE table_name = ?", [table_name]
+        ).fetchone()
+        logger.info(f"Watermark for {table_name}: order_id={row[0]}, order_date={row[1]}")
+
+    def snapshot_inventory(self, snapshot_date) -> bool:
+        """
+        Record the store x product positions of fact_inventory that changed since
+        the previous snapshot (delta encoding) and refresh inventory_daily_position
+        Pairs that disappeared from the source are recorded once with quantity 0.
+        Re-running the same day replaces that day's rows; a date before the latest
+        stored snapshot is rejected, since the later change rows were encoded
+        against the history without it.
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            self.create_schema(["fact_inventory_snapshot"])
+            params = {"snapshot_date": snapshot_date}
+            latest = self.connection.execute(
+                "SELECT max(snapshot_date) FROM fact_inventory_snapshot"
+            ).fetchone()[0]
+            if latest is not None and snapshot_date < latest:
+                logger.error(f"Inventory snapshot {snapshot_date} is before the latest snapshot {latest}; "
+                             f"snapshots can only be appended")
+                return False
+            with self.transaction():
+                self.connection.execute(
+                    "DELETE FROM fact_inventory_snapshot WHERE snapshot_date = $snapshot_date", params
+                )
+                changed = self.connection.execute("""
+                    INSERT INTO fact_inventory_snapshot
+                    WITH previous AS (
+                        SELECT store_id, product_id,
+                               arg_max(quantity_on_hand, snapshot_date) AS quantity_on_hand
+                        FROM fact_inventory_snapshot
+                        WHERE snapshot_date < $snapshot_date
+                        GROUP BY store_id, product_id
+                    )
+                    SELECT CAST($snapshot_date AS DATE),
+                           coalesce(c.store_id, p.store_id),
+                           coalesce(c.product_id, p.product_id),
+                           coalesce(c.quantity_on_hand, 0),
+                           coalesce(c.quantity_on_hand, 0) - coalesce(p.quantity_on_hand, 0)
+                    FROM fact_inventory c
+                    FULL JOIN previous p ON c.store_id = p.store_id AND c.product_id = p.product_id
+                    WHERE coalesce(c.quantity_on_hand, 0) IS DISTINCT FROM p.quantity_on_hand
+                """, params).fetchone()[0]
+
+            # ตำแหน่งของทุกวัน = change row ล่าสุดที่ไม่เกินวันนั้น (ASOF JOIN, ไม่เก็บแบบ dense)
+            self.connection.execute("""
+                CREATE OR REPLACE VIEW inventory_daily_position AS
+                WITH days AS (
+                    SELECT CAST(unnest(generate_series(min(snapshot_date), greatest(max(snapshot_date), current_date),
+                                                       INTERVAL 1 DAY)) AS DATE) AS position_date
+                    FROM fact_inventory_snapshot
+                ),
+                pairs AS (
+                    SELECT DISTINCT store_id, product_id FROM fact_inventory_snapshot
+                )
+                SELECT d.position_date, k.store_id, k.product_id, s.quantity_on_hand
+                FROM days d
+                CROSS JOIN pairs k
+                ASOF JOIN fact_inventory_snapshot s
+                    ON s.store_id = k.store_id AND s.product_id = k.product_id
+                    AND d.position_date >= s.snapshot_date
+            """)
+            logger.info(f"Inventory snapshot {snapshot_date}: {changed} changed positions recorded")
+            return True
+        except Exception as e:
+            logger.error(f"Error recording inventory snapshot: {str(e)}")
+            return False
+
+    def fact_date_range(self) -> Optional[tuple]:
+        """
+        Earliest and latest date referenced by fact_sales
+        Returns:
+            tuple: (min_date, max_date), or None if there is no fact yet
+        """
+        if not self.connection:
+            self.connect()
+        if "fact_sales" not in self.existing_tables():
+            return None
+        row = self.connection.execute("""
+            SELECT CAST(strptime(CAST(lo AS VARCHAR), '%Y%m%d') AS DATE),
+                   CAST(strptime(CAST(hi AS VARCHAR), '%Y%m%d') AS DATE)
+            FROM (
+                SELECT least(min(order_date_key), min(required_date_key), min(shipped_date_key)) AS lo,
+                       greatest(max(order_date_key), max(required_date_key), max(shipped_date_key)) AS hi
+                FROM fact_sales
+            )
+        """).fetchone()
+        return row if row[0] is not None else None
+
+    def date_dimension_range(self, columns: List[str]) -> Optional[tuple]:
+        """
+        Date range already stored in dim_date
+        A missing table or one with an older layout than columns is (re-)created empty.
+        Returns:
+            tuple: (min_date, max_date), or None if dim_date is empty
+        """
+        if not self.connection:
+            self.connect()
+        current = [row[0] for row in self.connection.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = 'main' AND table_name = 'dim_date' ORDER BY ordinal_position"
+        ).fetchall()]
+        if current != columns:
+            if current:
+                logger.info("dim_date has an outdated layout; rebuilding it")
+                self.connection.execute("DROP TABLE dim_date")
+            self.create_schema(["dim_date"])
+            return None
+        row = self.connection.execute("SELECT min(date), max(date) FROM dim_date").fetchone()
+        return row if row[0] is not None else None
+
+    def stage_csv(self, table_name: str, files: List[str]) -> bool:
+        """
+        Land source files directly into a staging table with DuckDB's parallel CSV reader
+        (DuckDB-native path, no Polars/Arrow copy). Pinned schemas from Config.CSV_SCHEMAS are applied.
+        Args:
+            table_name: source table name, staged as stg_<table_name>
+            files: CSV files (plain or compressed) to read
+        """
+        try:
+            if not self.connection:
+                self.connect()
+
+            options = ["header = true", "nullstr = ['', 'NULL', 'null', 'N/A', 'n/a']",
+                       f"dateformat = '{self.config.DATE_FORMAT}'"]
+            schema = self.config.CSV_SCHEMAS.get(table_name)
+            if schema:
+                types = ", ".join(f"'{col}': '{DUCKDB_TYPES.get(dtype, 'VARCHAR')}'" for col, dtype in schema.items())
+                options.append(f"types = {{{types}}}")
+
+            self.connection.execute(
+                f"CREATE OR REPLACE TABLE stg_{table_name} AS "
+                f"SELECT * FROM read_csv({files!r}, {', '.join(options)})"
+            )
+            rows = self.connection.execute(f"SELECT count(*) FROM stg_{table_name}").fetchone()[0]
+            logger.info(f"Staged {rows} rows into stg_{table_name} (DuckDB-native)")
+            return True
+        except Exception as e:
+            logger.error(f"Error staging {table_name}: {str(e)}")
+            return False
+
+    def run_sql_transform(self, table_name: str, query: str, mode: str = "replace",
+                          keys: Optional[List[str]] = None) -> bool:
+        """
+        Build a warehouse table from a SQL query over the staging tables
+        Args:
+            mode: "replace", "append", "truncate", "merge", "upsert" or "scd2" (see load_dataframe)
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            if mode in ("append", "truncate", "merge"):
+                self.insert_from(table_name, f"({query})", mode)
+            elif mode in ("upsert", "scd2"):
+                self.connection.execute(f"CREATE OR REPLACE TEMP TABLE temp_sql AS {query}")
+                if mode == "upsert":
+                    self.upsert_from(table_name, "temp_sql", keys)
+                else:
+                    self.scd2_merge(table_name, "temp_sql", keys[0])
+                self.connection.execute("DROP TABLE temp_sql")
+            else:
+                self.connection.execute(f"CREATE OR REPLACE TABLE {table_name} AS {query}")
+            rows = self.connection.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+            logger.info(f"Successfully built {rows} rows into {table_name} (SQL)")
+            return True
+        except Exception as e:
+            logger.error(f"Error building {table_name} with SQL: {str(e)}")
+            return False
+
+    def refresh_aggregates(self, since=None) -> bool:
+        """
+        Build the sales cubes (AGGREGATE_TABLES) from fact_sales
+        Args:
+            since: first order_date touched by an incremental fact load; only the
+                periods from there on are recomputed. None rebuilds every cube.
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            existing = self.existing_tables()
+            for table_name, (period_col, period_expr, keys) in AGGREGATE_TABLES.items():
+                period = period_expr.format(col="order_date")
+                query = f"""
+                    SELECT {period} AS {period_col}, {", ".join(keys)}, {AGGREGATE_MEASURES}
+                    FROM fact_sales
+                    {{where}}
+                    GROUP BY ALL
+                    ORDER BY ALL
+                """
+                if since is None or table_name not in existing:
+                    self.connection.execute(f"CREATE OR REPLACE TABLE {table_name} AS {query.format(where='')}")
+                else:
+                    # คำนวณใหม่ทั้ง period ที่ since ตกอยู่ (เช่นทั้งเดือน) แล้วแทนที่ในทรานแซกชันเดียว
+                    start = period_expr.format(col="CAST(? AS DATE)")
+                    with self.transaction():
+                        self.connection.execute(f"DELETE FROM {table_name} WHERE {period_col} >= {start}", [since])
+                        self.connection.execute(
+                            f"INSERT INTO {table_name} BY NAME {query.format(where=f'WHERE order_date >= {start}')}",
+                            [since]
+                        )
+                rows = self.connection.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+                logger.info(f"Refreshed {table_name}: {rows} rows" + (f" (from {since})" if since else ""))
+            return True
+        except Exception as e:
+            logger.error(f"Error refreshing sales aggregates: {str(e)}")
+            return False
+
+    def refresh_customer_metrics(self, changed: Optional[str] = None) -> bool:
+        """
+        Build agg_customer (one row per customer, CUSTOMER_MEASURES + RFM scores) from fact_sales
+        Args:
+            changed: SQL filter on fact_sales selecting the orders of an incremental load;
+                only their customers are recomputed. None rebuilds the table.
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            query = f"""
+                SELECT customer_id, {CUSTOMER_MEASURES}
+                FROM fact_sales
+                {{where}}
+                GROUP BY customer_id
+            """
+            with self.transaction():
+                if changed is None or "agg_customer" not in self.existing_tables():
+                    self.connection.execute(f"""
+                        CREATE OR REPLACE TABLE agg_customer AS
+                        SELECT *,
+                               CAST(NULL AS INTEGER) AS recency_days,
+                               CAST(NULL AS TINYINT) AS recency_score,
+                               CAST(NULL AS TINYINT) AS frequency_score,
+                               CAST(NULL AS TINYINT) AS monetary_score,
+                               CAST(NULL AS VARCHAR) AS rfm_score
+                        FROM ({query.format(where='')})
+                        ORDER BY customer_id
+                    """)
+                else:
+                    # คำนวณใหม่เฉพาะลูกค้าที่มี order ใหม่/แก้ไข (ทั้งประวัติของลูกค้าคนนั้น)
+                    customers = f"SELECT DISTINCT customer_id FROM fact_sales WHERE {changed}"
+                    self.connection.execute(f"DELETE FROM agg_customer WHERE customer_id IN ({customers})")
+                    self.connection.execute(
+                        f"INSERT INTO agg_customer BY NAME "
+                        f"{query.format(where=f'WHERE customer_id IN ({customers})')}"
+                    )
+                # คะแนนเป็นแบบสัมพัทธ์ (quintile) จึงคิดใหม่ทั้งตาราง: scan แค่หนึ่งแถวต่อลูกค้า
+                self.connection.execute(f"""
+                    UPDATE agg_customer a
+                    SET recency_days = s.recency_days,
+                        recency_score = s.recency_score,
+                        frequency_score = s.frequency_score,
+                        monetary_score = s.monetary_score,
+                        rfm_score = concat(s.recency_score, s.frequency_score, s.monetary_score)
+                    FROM ({CUSTOMER_SCORES}) s
+                    WHERE a.customer_id = s.customer_id
+                """)
+            rows = self.connection.execute("SELECT count(*) FROM agg_customer").fetchone()[0]
+            logger.info(f"Refreshed agg_customer: {rows} customers" + (" (changed orders only)" if changed else ""))
+            return True
+        except Exception as e:
+            logger.error(f"Error refreshing customer metrics: {str(e)}")
+            return False
+
+    def write_partitions(self, table_name: str, since=None) -> bool:
+        """
+        Mirror a fact as Parquet under Config.PARTITION_DIR/<table>/year=YYYY/month=M
+        and expose it as the view <table>_partitioned
+        Queries on the view that filter year / month only open the matching folders;
+        inside a file rows are ordered by date, so date filters also skip row groups.
+        The new set is written to <table>.tmp and swapped in as a whole, so a reader never
+        sees half-written partitions; under BLUE_GREEN it lives in the version's own directory.
+        Args:
+            since: first date touched by an incremental load; only the months from there
+                on are rewritten. None rewrites every partition.
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            date_col = PARTITION_DATES[table_name]
+            target = self.version_dir(self.config.PARTITION_DIR) / table_name
+            stage = target.with_name(f"{table_name}.tmp")
+            shutil.rmtree(stage, ignore_errors=True)
+            stage.mkdir(parents=True)
+
+            # เดือนก่อน since ไม่เปลี่ยน: hard link ไฟล์เดิมเข้าชุดใหม่แทนการเขียนซ้ำ
+            if since is not None and target.exists():
+                for folder in target.glob("year=*/month=*"):
+                    year = int(folder.parent.name.split("=")[1])
+                    month = int(folder.name.split("=")[1])
+                    if (year, month) < (since.year, since.month):
+                        shutil.copytree(folder, stage / folder.parent.name / folder.name, copy_function=os.link)
+
+            where = "" if since is None else f"WHERE {date_col} >= date_trunc('month', CAST(? AS DATE))"
+            self.connection.execute(f"""
+                COPY (
+                    SELECT *, year({date_col}) AS year, month({date_col}) AS month
+                    FROM {table_name}
+                    {where}
+                    ORDER BY {date_col}
+                ) TO '{stage.as_posix()}'
+                (FORMAT parquet, PARTITION_BY (year, month), OVERWRITE_OR_IGNORE, FILENAME_PATTERN 'data_{{i}}')
+            """, [] if since is None else [since])
+            self.swap_dir(stage, target)
+            self.create_partition_view(table_name)
+            partitions = len(list(target.glob("year=*/month=*")))
+            logger.info(f"Wrote {table_name} partitions to {target}: {partitions} months"
+                        + (f" (rewritten from {since})" if since else ""))
+            return True
+        except Exception as e:
+            logger.error(f"Error writing partitions of {table_name}: {str(e)}")
+            return False
+
+    def create_partition_view(self, table_name: str):
+        """(Re)point the view <table>_partitioned at the partitions of this warehouse version"""
+        target = self.version_dir(self.config.PARTITION_DIR) / table_name
+        if not target.exists():
+            return
+        # path แบบ absolute: view ใช้ได้ไม่ว่า process ที่อ่านจะรันจาก directory ไหน
+        files = (target.resolve() / "*" / "*" / "*.parquet").as_posix()
+        self.connection.execute(f"""
+            CREATE OR REPLACE VIEW {table_name}_partitioned AS
+            SELECT * FROM read_parquet('{files}', hive_partitioning = true)
+        """)
+
+    def export_lake(self) -> bool:
+        """
+        Export every dim_/fact_/agg_ table to Config.LAKE_DIR as zstd Parquet
+        Writes <table>.parquet (rows of a fact ordered by its date, so row-group min/max
+        statistics let readers skip row groups), manifest.json with row counts and
+        per-column min/max, and lake.duckdb: a catalog of views with the table names over
+        the files. Readers open lake.duckdb read-only (or the files directly), so any
+        number of processes can query without the warehouse file lock.
+        Every file is written to a temp name and renamed into place. Under BLUE_GREEN the
+        lake of a build goes to its version directory and publish() switches
+        LAKE_DIR/lake.duckdb and manifest.json to it.
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            root = Path(self.config.LAKE_DIR)
+            lake = self.version_dir(self.config.LAKE_DIR)
+            lake.mkdir(parents=True, exist_ok=True)
+            tables = [name for name in self.existing_tables()
+                      if name.startswith(("dim_", "fact_", "agg_"))]
+            views = [row[0] for row in self.connection.execute(
+                "SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall()]
+            tables = [name for name in tables if name not in views]
+
+            manifest = {"exported_at": datetime.now().isoformat(timespec="seconds"),
+                        "version": None if lake == root else lake.name, "tables": {}}
+            for table_name in tables:
+                target = lake / f"{table_name}.parquet"
+                temp = lake / f"{table_name}.parquet.tmp"
+                order = f"ORDER BY {PARTITION_DATES[table_name]}" if table_name in PARTITION_DATES else ""
+                self.connection.execute(f"""
+                    COPY (SELECT * FROM {table_name} {order}) TO '{temp.as_posix()}'
+                    (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {self.config.LAKE_ROW_GROUP_SIZE})
+                """)
+                os.replace(temp, target)
+
+                row_groups = self.connection.execute(
+                    "SELECT num_rows, num_row_groups FROM parquet_file_metadata(?)", [target.as_posix()]
+                ).fetchone()
+                summary = self.connection.execute(
+                    f"SELECT column_name, column_type, min, max, null_percentage FROM (SUMMARIZE {table_name})"
+                ).fetchall()
+                manifest["tables"][table_name] = {
+                    # path เทียบกับ LAKE_DIR: manifest ที่ publish แล้วอยู่ที่ root
+                    "file": target.relative_to(root).as_posix(),
+                    "rows": row_groups[0],
+                    "row_groups": row_groups[1],
+                    "bytes": target.stat().st_size,
+                    "columns": {name: {"type": dtype, "min": low, "max": high,
+                                       "null_percentage": None if nulls is None else float(nulls)}
+                                for name, dtype, low, high, nulls in summary},
+                }
+
+            temp = lake / "manifest.json.tmp"
+            temp.write_text(json.dumps(manifest, indent=2, default=str), encoding="utf-8")
+            os.replace(temp, lake / "manifest.json")
+
+            # catalog ใหม่เขียนแยกแล้วค่อยสลับ: reader ที่เปิดไฟล์เดิมอยู่ไม่ถูกรบกวน
+            catalog = lake / "lake.duckdb"
+            temp = lake / "lake.duckdb.tmp"
+            temp.unlink(missing_ok=True)
+            with dd.connect(str(temp)) as connection:
+                for table_name in tables:
+                    path = (lake.resolve() / f"{table_name}.parquet").as_posix()
+                    connection.execute(f"CREATE VIEW {table_name} AS SELECT * FROM read_parquet('{path}')")
+            os.replace(temp, catalog)
+
+            total = sum(entry["bytes"] for entry in manifest["tables"].values())
+            logger.info(f"Exported {len(tables)} tables to the Parquet lake at {lake} ({total / 1e6:.1f} MB)")
+            return True
+        except Exception as e:
+            logger.error(f"Error exporting the Parquet lake: {str(e)}")
+            return False
+
+    def optimize_warehouse(self, resort: Optional[List[str]] = None) -> bool:
+        """
+        Post-load physical layout: rewrite the facts of OPTIMIZE_SORT in order, build the
+        ART indexes of OPTIMIZE_INDEXES, refresh statistics (ANALYZE) and CHECKPOINT
+        Table sizes before and after are logged.
+        Args:
+            resort: tables rewritten in full by this run; only these are sorted again and
+                ANALYZE only runs after a sort (None = every table of OPTIMIZE_SORT).
+                Incremental runs pass [] so their cost follows the rows they loaded.
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            # checkpoint ก่อนวัดขนาด ข้อมูลใน WAL ยังไม่อยู่ใน storage
+            self.connection.execute("CHECKPOINT")
+            existing = self.existing_tables()
+            resort = [name for name in OPTIMIZE_SORT
+                      if name in existing and (resort is None or name in resort)]
+            before = {name: self.table_storage(name) for name in resort}
+            database_before = self.database_size()
+
+            for table_name in resort:
+                self.sort_table(table_name, OPTIMIZE_SORT[table_name])
+            # index ที่มีอยู่แล้ว DuckDB ดูแลเองตอน insert: IF NOT EXISTS ไม่ทำอะไรซ้ำ
+            for table_name, columns in OPTIMIZE_INDEXES.items():
+                if table_name in existing:
+                    for col in columns:
+                        self.connection.execute(
+                            f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{col} ON {table_name} ({col})"
+                        )
+            if resort:
+                self.connection.execute("ANALYZE")
+            self.connection.execute("CHECKPOINT")
+
+            for name in resort:
+                (groups_before, size_before), (groups_after, size_after) = before[name], self.table_storage(name)
+                logger.info(f"Optimized {name}: {groups_before} -> {groups_after} row groups, "
+                            f"{size_before / 1e6:.1f} -> {size_after / 1e6:.1f} MB")
+            logger.info(f"Warehouse size after optimize: {database_before / 1e6:.1f} -> "
+                        f"{self.database_size() / 1e6:.1f} MB used")
+            return True
+        except Exception as e:
+            logger.error(f"Error optimizing the warehouse: {str(e)}")
+            return False
+
+    def sort_table(self, table_name: str, columns: List[str]):
+        """
+        Rewrite a table ordered by columns
+        A copy with the table's own DDL (types, primary key) is filled in order and
+        replaces the table in one transaction. DELETE + INSERT would leave the old
+        row groups in the file.
+        """
+        ddl = self.connection.execute(
+            "SELECT sql FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = ?", [table_name]
+        ).fetchone()[0]
+        prefix = f"CREATE TABLE {table_name}("
+        if not ddl.startswith(prefix):
+            raise ValueError(f"Unexpected DDL for {table_name}: {ddl[:60]}")
+        with self.transaction():
+            self.connection.execute(f"CREATE TABLE {table_name}__sorted(" + ddl[len(prefix):])
+            self.connection.execute(
+                f"INSERT INTO {table_name}__sorted SELECT * FROM {table_name} ORDER BY {', '.join(columns)}"
+            )
+            self.connection.execute(f"DROP TABLE {table_name}")
+            self.connection.execute(f"ALTER TABLE {table_name}__sorted RENAME TO {table_name}")
+
+    def table_storage(self, table_name: str) -> tuple:
+        """(row groups, approximate bytes) of a table from its storage blocks"""
+        block_size = self.connection.execute("SELECT block_size FROM pragma_database_size()").fetchone()[0]
+        row_groups, blocks = self.connection.execute(
+            f"SELECT count(DISTINCT row_group_id), count(DISTINCT block_id) FROM pragma_storage_info('{table_name}')"
+        ).fetchone()
+        return row_groups, blocks * block_size
+
+    def database_size(self) -> int:
+        """Bytes in use in the database file"""
+        return self.connection.execute("SELECT used_blocks * block_size FROM pragma_database_size()").fetchone()[0]
+
+    def collect_lazy_frames(self, transformed_data: Dict[str, pl.DataFrame]) -> Dict[str, pl.DataFrame]:
+        """
+        Collect every LazyFrame with a single pl.collect_all call (lazy mode)
+        Plans are optimized together, so scans shared by several tables are read once.
+        """
+        lazy_names = [name for name, df in transformed_data.items() if isinstance(df, pl.LazyFrame)]
+        if not lazy_names:
+            return transformed_data
+
+        engine = "streaming" if self.config.STREAMING_COLLECT else "auto"
+        logger.info(f"Collecting {len(lazy_names)} lazy tables (engine={engine})")
+        frames = pl.collect_all([transformed_data[name] for name in lazy_names], engine=engine)
+
+        collected = dict(transformed_data)
+        collected.update(zip(lazy_names, frames))
+        return collected
+
+    def read_columns(self, table_name: str, columns: List[str]) -> Optional[pl.DataFrame]:
+        """Distinct values of some columns of a warehouse table, or None if the table does not exist"""
+        if not self.connection:
+            self.connect()
+        if table_name not in self.existing_tables():
+            return None
+        return self.connection.execute(f"SELECT DISTINCT {', '.join(columns)} FROM {table_name}").pl()
+
+    def create_current_views(self):
+        """
+        (Re)create <dim>_current for the dimensions of SCD2_KEYS: only the current version of
+        each key when the table keeps SCD2 history, every row otherwise. Readers query these
+        views and need not know which tables are in Config.SCD2_TABLES.
+        """
+        if not self.connection:
+            self.connect()
+        existing = self.existing_tables()
+        for table_name in SCD2_KEYS:
+            if table_name not in existing:
+                continue
+            has_history = self.connection.execute(
+                "SELECT count(*) FROM information_schema.columns "
+                "WHERE table_schema = 'main' AND table_name = ? AND column_name = 'is_current'", [table_name]
+            ).fetchone()[0] > 0
+            where = "WHERE is_current" if has_history else ""
+            self.connection.execute(f"CREATE OR REPLACE VIEW {table_name}_current AS SELECT * FROM {table_name} {where}")
+
+    def existing_tables(self) -> List[str]:
+        """Names of the tables currently in the warehouse"""
+        if not self.connection:
+            self.connect()
+        rows = self.connection.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def load_all_data(self, transformed_data: Dict[str, pl.DataFrame], full_refresh: bool = True,
+                      upsert_tables: Optional[Dict[str, List[str]]] = None) -> bool:
         """
         Load all transformed data into the data warehouse
         Expected keys:
         - dim_date, dim_customers, dim_brands, dim_categories, dim_products,
             dim_stores, dim_staffs, dim_order_status,
             fact_sales, fact_inventory
+        Args:
+            full_refresh: re-create every table; False only re-creates the tables in transformed_data
+            upsert_tables: table -> key columns for tables that are upserted instead of replaced
+                (incremental fact loads); existing ones are never re-created
         """
         logger.info("Starting data loading process")
         if not self.connection:
             self.connect()
 
+        # Lazy mode: materialize all query plans at once
+        transformed_data = self.collect_lazy_frames(transformed_data)
+
+        # ตาราง upsert และ SCD2 ที่มีอยู่แล้วต้องไม่ถูก CREATE OR REPLACE (เก็บประวัติไว้)
+        existing = self.existing_tables()
+        upsert_tables = {name: keys for name, keys in (upsert_tables or {}).items() if name in existing}
+        scd2_tables = [name for name in existing if self.scd2_key(name)]
+
         # Create schema first
-        self.create_schema()
+        # parallel mode: ตารางที่โหลดในขั้นนี้สร้างใหม่ใน transaction ของตัวเอง (ดู load_parallel)
+        schema_tables = None if full_refresh else list(transformed_data)
+        exclude = list(upsert_tables) + scd2_tables
+        parallel = self.config.LOAD_PARALLEL
+        self.create_schema(schema_tables, exclude=exclude + (list(transformed_data) if parallel else []))
 
         # Optional: inspect existing tables
         tables_in_schema = self.connection.sql("SELECT table_name FROM information_schema.tables WHERE table_schema = 'main'")
@@ -264,8 +1399,9 @@ class DataLoader:
         else:
             logger.warning("tables_in_schema is None")
         
-        success_count = 0
         total_tables = len(transformed_data)
+        # (table, mode, keys) ตามลำดับที่โหลด
+        plan = []
 
         # Load dimensions first (กำหนดลำดับเพื่อความชัดเจน)
         dim_order = [
@@ -280,21 +1416,70 @@ class DataLoader:
         ]
         for name in dim_order:
             if name in transformed_data:
-                if self.load_dataframe(transformed_data[name], name):
-                    success_count += 1
+                key = self.scd2_key(name)
+                mode, keys = ("scd2", [key]) if key else (self.replace_mode(name), None)
+                plan.append((name, mode, keys))
 
         # Load facts
         fact_order = ["fact_sales", "fact_inventory"]
         for name in fact_order:
             if name in transformed_data:
-                if self.load_dataframe(transformed_data[name], name):
-                    success_count += 1
+                mode = "upsert" if name in upsert_tables else self.replace_mode(name)
+                plan.append((name, mode, upsert_tables.get(name)))
 
         # Load any remaining tables (ถ้ามี key อื่นๆ)
         for name, df in transformed_data.items():
-            if name.startswith(("dim_", "fact_")) and name not in dim_order + fact_order:
-                if self.load_dataframe(df, name):
-                    success_count += 1
+            if name.startswith(("dim_", "fact_", "reject_")) and name not in dim_order + fact_order:
+                plan.append((name, "replace", None))
+
+        if parallel:
+            create = [name for name, _, _ in plan
+                      if (schema_tables is None or name in schema_tables) and name not in exclude]
+            success_count = self.load_parallel(transformed_data, plan, create)
+        else:
+            success_count = sum(self.load_dataframe(transformed_data[name], name, mode, keys)
+                                for name, mode, keys in plan)
+        self.create_current_views()
 
         logger.info(f"Data loading complete: {success_count}/{total_tables} tables loaded successfully")
-        return success_count == total_tables
\ No newline at end of file
+        return success_count == total_tables
+
+    def load_parallel(self, transformed_data: Dict[str, pl.DataFrame], plan: List[tuple],
+                      create: List[str]) -> int:
+        """
+        Load the tables of plan concurrently, one cursor per table (Config.LOAD_MAX_WORKERS)
+        Every cursor keeps its transaction open until all tables are loaded; then they all
+        commit, or all roll back if any load failed, leaving the previous warehouse as it was.
+        DuckDB transactions are per connection, so a COMMIT that itself fails cannot undo
+        the others.
+        Args:
+            plan: (table, mode, keys) per table, as for load_dataframe
+            create: tables whose DDL is (re)created inside their own transaction
+        Returns:
+            int: number of tables loaded (0 after a rollback)
+        """
+        def load(name: str, mode: str, keys: Optional[List[str]]):
+            worker = DataLoader()
+            worker.connection = self.connection.cursor()
+            worker.in_transaction = True
+            worker.connection.execute("BEGIN TRANSACTION")
+            try:
+                if name in create:
+                    worker.create_schema([name])
+            except Exception:
+                return worker, False
+            return worker, worker.load_dataframe(transformed_data[name], name, mode, keys)
+
+        logger.info(f"Loading {len(plan)} tables in parallel (max {self.config.LOAD_MAX_WORKERS} workers)")
+        with ThreadPoolExecutor(max_workers=self.config.LOAD_MAX_WORKERS) as executor:
+            results = list(executor.map(lambda entry: load(*entry), plan))
+
+        loaded = sum(ok for _, ok in results)
+        finish = "COMMIT" if loaded == len(plan) else "ROLLBACK"
+        for worker, _ in results:
+            worker.connection.execute(finish)
+            worker.connection.close()
+        if finish == "ROLLBACK":
+            logger.error(f"❌ {len(plan) - loaded} table loads failed; all {len(plan)} loads rolled back")
+            return 0
+        return loaded
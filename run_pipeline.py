@@ -1,13 +1,17 @@
 from src import Config
 from src.etl.extract import SrcChecker, DataExtractor
 from src.etl.transform import DataTransformer
-from src.etl.load import DataLoader
+from src.etl.validate import DataValidator, VALIDATION_RULES
+from src.etl.load import DataLoader, PARTITION_DATES, OPTIMIZE_SORT
+from src.database import ConnectionManager
 
 print(f'Data Directory: {Config.DATA_DIR}')
 print(f'Data Warehouse Directory: {Config.DATABASE_DIR}')
 
-import os                            
+import sys
 import logging                      # manage loginfo
+import polars as pl
+from datetime import date, timedelta
 from src import Config
 # Get emoji :# https://emojipedia.org
 
@@ -20,12 +24,23 @@ logger = logging.getLogger(__name__)
 class ETLPipeline:
     """ETL Pipeline class to manage the ETL process"""
 
+    # Incremental fact load: upsert ทีละ order (ลบทุก line ของ order ที่เปลี่ยนแล้ว insert ใหม่)
+    # ครอบคลุม PK (order_id, item_id) และรองรับ item ที่ถูกลบออกจาก order
+    UPSERT_KEYS = {"fact_sales": ["order_id"]}
+
     def __init__(self):
         self.config = Config()
         self.check_src = SrcChecker()
         self.extractor = DataExtractor() # self.extractor คือ instance ของ class DataExtractor
         self.transformer = DataTransformer()
+        self.validator = DataValidator()
         self.loader = DataLoader()
+        # Incremental runs (ตั้งค่าใน plan_incremental): None = ทำทุกตาราง
+        self.targets = None
+        self.sources = None
+        self.fingerprints = None
+        # Incremental fact load (ตั้งค่าใน plan_fact_load): None = rebuild fact ทั้งหมด
+        self.fact_watermark = None
 
     def run_check_src(self,src: list[str]=['csv']) -> bool:
         """
@@ -37,14 +52,216 @@ class ETLPipeline:
                 success = self.check_src.check_src_csv()
          
         return success
+
+    def plan_incremental(self) -> bool:
+        """
+        Decide which warehouse tables need rebuilding (Config.INCREMENTAL_RUNS)
+        A table is rebuilt when one of its source files changed since the last
+        successful run, or when it is missing from the warehouse.
+        Returns:
+            bool: True if there is anything to do
+        """
+        self.fingerprints = self.check_src.source_fingerprints()
+        changed = self.check_src.changed_sources(self.loader.connect(), self.fingerprints)
+        existing = self.loader.existing_tables()
+
+        table_sources = self.transformer.TABLE_SOURCES
+        targets = [table for table, sources in table_sources.items()
+                   if table not in existing or any(src in changed for src in sources)]
+        if len(targets) == len(table_sources):
+            logger.info("All tables need rebuilding; running a full refresh")
+            self.targets, self.sources = None, None
+            return True
+
+        self.targets = targets
+        self.sources = sorted({src for table in targets for src in table_sources[table]})
+        logger.info(f"Incremental run: rebuilding {targets} from {self.sources}")
+        if not targets:
+            self.loader.disconnect()
+        return bool(targets)
+
+    def plan_fact_load(self):
+        """
+        Read the fact_sales watermark when Config.FACT_LOAD_MODE is "incremental"
+        Without a previous load the fact is built in full.
+        """
+        if self.config.FACT_LOAD_MODE != "incremental":
+            return
+        self.loader.connect()
+        self.fact_watermark = self.loader.get_watermark("fact_sales")
+        self.loader.disconnect()
+        if self.fact_watermark is None:
+            logger.info("No fact_sales watermark yet; loading the full fact")
+        else:
+            logger.info(f"Incremental fact load from watermark {self.fact_watermark} "
+                        f"(change window {self.config.FACT_CHANGE_WINDOW_DAYS} days)")
+
+    def run_inventory_snapshot(self) -> bool:
+        """
+        Append the day's inventory changes to fact_inventory_snapshot
+        (only when fact_inventory was rebuilt in this run)
+        """
+        if self.targets is not None and "fact_inventory" not in self.targets:
+            return True
+        self.loader.connect()
+        if "fact_inventory" not in self.loader.existing_tables():
+            self.loader.disconnect()
+            return True
+        snapshot_date = (date.fromisoformat(self.config.INVENTORY_SNAPSHOT_DATE)
+                         if self.config.INVENTORY_SNAPSHOT_DATE else date.today())
+        success = self.loader.snapshot_inventory(snapshot_date)
+        self.loader.disconnect()
+        return success
+
+    def run_date_dimension(self) -> bool:
+        """
+        Keep dim_date covering the fact dates (± Config.DATE_DIM_PADDING_DAYS)
+        dim_date is stored once; later runs only append the missing days before
+        or after the range that is already there.
+        """
+        self.loader.connect()
+        bounds = self.loader.fact_date_range()
+        if bounds is None:
+            self.loader.disconnect()
+            return True
+        padding = timedelta(days=self.config.DATE_DIM_PADDING_DAYS)
+        start, end = bounds[0] - padding, bounds[1] + padding
+
+        columns = self.transformer.create_date_dimension(start, start).columns
+        existing = self.loader.date_dimension_range(columns)
+        if existing is None:
+            missing = [(start, end)]
+        else:
+            missing = []
+            if start < existing[0]:
+                missing.append((start, existing[0] - timedelta(days=1)))
+            if end > existing[1]:
+                missing.append((existing[1] + timedelta(days=1), end))
+
+        success = True
+        for first, last in missing:
+            dim_date = self.transformer.create_date_dimension(first, last)
+            success = self.loader.load_dataframe(dim_date, "dim_date", "append") and success
+        if not missing:
+            logger.info(f"dim_date already covers {start} .. {end}")
+        self.loader.disconnect()
+        return success
+
+    def fact_changes(self) -> tuple:
+        """
+        (first order_date, SQL filter) of the orders changed by an incremental fact load
+        Both are None after a full load; since is None when no order changed.
+        """
+        if self.fact_watermark is None:
+            return None, None
+        changed = self.transformer.changed_orders_sql(self.fact_watermark)
+        since = self.loader.connection.execute(
+            f"SELECT min(order_date) FROM fact_sales WHERE {changed}"
+        ).fetchone()[0]
+        return since, changed
+
+    def run_partitions(self) -> bool:
+        """
+        Rewrite the Parquet partitions of Config.PARTITIONED_FACTS
+        After an incremental fact load only the months of the changed orders are rewritten.
+        A blue/green build starts from links to the published partitions, so facts that
+        are not rewritten get their view pointed at the build's copy.
+        """
+        if not self.config.PARTITIONED_FACTS:
+            return True
+        self.loader.connect()
+        success = True
+        for table_name in self.config.PARTITIONED_FACTS:
+            if table_name not in PARTITION_DATES:
+                logger.warning(f"{table_name} has no partition date column; skipped")
+                continue
+            since = None
+            rewrite = self.targets is None or table_name in self.targets
+            if rewrite and table_name == "fact_sales" and self.fact_watermark is not None:
+                since, _ = self.fact_changes()
+                if since is None:
+                    logger.info("No changed orders; fact_sales partitions are up to date")
+                    rewrite = False
+            if rewrite:
+                success = self.loader.write_partitions(table_name, since) and success
+            elif self.config.BLUE_GREEN:
+                self.loader.create_partition_view(table_name)
+        self.loader.disconnect()
+        return success
+
+    def run_aggregates(self) -> bool:
+        """
+        Refresh the sales cubes and agg_customer from fact_sales (Config.BUILD_AGGREGATES)
+        After an incremental fact load only the periods and customers touched by the
+        changed orders are recomputed; order_date is assumed not to move, as for the watermark.
+        """
+        if not self.config.BUILD_AGGREGATES:
+            return True
+        if self.targets is not None and "fact_sales" not in self.targets:
+            return True
+        self.loader.connect()
+        since, changed = self.fact_changes()
+        if self.fact_watermark is not None and since is None:
+            logger.info("No changed orders; sales aggregates are up to date")
+            self.loader.disconnect()
+            return True
+        success = self.loader.refresh_aggregates(since)
+        success = self.loader.refresh_customer_metrics(changed) and success
+        self.loader.disconnect()
+        return success
+
+    def run_optimize(self) -> bool:
+        """
+        Reorder the facts, build indexes and refresh statistics (Config.OPTIMIZE_WAREHOUSE)
+        Only facts rebuilt in full by this run are re-sorted; an incremental fact load or a
+        run that did not touch the fact keeps the existing layout.
+        """
+        if not self.config.OPTIMIZE_WAREHOUSE:
+            return True
+        resort = [table for table in OPTIMIZE_SORT
+                  if (self.targets is None or table in self.targets)
+                  and not (table == "fact_sales" and self.fact_watermark is not None)]
+        self.loader.connect()
+        success = self.loader.optimize_warehouse(resort)
+        self.loader.disconnect()
+        return success
+
+    def run_export_lake(self) -> bool:
+        """Export the finished warehouse tables to the Parquet lake (Config.EXPORT_LAKE)"""
+        if not self.config.EXPORT_LAKE:
+            return True
+        self.loader.connect()
+        success = self.loader.export_lake()
+        self.loader.disconnect()
+        return success
+
+    def update_watermarks(self):
+        """Record the new fact_sales watermark if the fact was built in this run"""
+        if self.targets is not None and "fact_sales" not in self.targets:
+            return
+        self.loader.connect()
+        if "fact_sales" in self.loader.existing_tables():
+            self.loader.update_watermark("fact_sales")
+        self.loader.disconnect()
+
+    def save_source_state(self):
+        """Record the source fingerprints once the whole run succeeded"""
+        if self.fingerprints is None:
+            return
+        self.check_src.save_fingerprints(self.loader.connect(), self.fingerprints)
+        self.loader.disconnect()
     
     def run_extract(self):
         """
         Run the extraction step and return raw data
         """
         logger.info("Running extraction step...")
-        raw_data = self.extractor.extract_data()
-        if raw_data:
+        # ตารางใน batched mode จะถูกอ่านทีละ batch ใน run_batched แทน
+        skip_tables = self.batched_tables() + self.native_tables()
+        if self.sources is not None:
+            skip_tables += [t for t in self.config.CSV_FILES if t not in self.sources]
+        raw_data = self.extractor.extract_data(skip_tables=skip_tables)
+        if raw_data is not None:
             logger.info("✅ Complete all reading the file.")
         else:
             logger.error("❌ Extraction failed.")
@@ -59,13 +276,95 @@ class ETLPipeline:
         logger.info("="*50)
       
         # Transform the raw data using the DataTransformer
-        transformed_data = self.transformer.transform_all_data(raw_data)
+        transformed_data = self.transformer.transform_all_data(raw_data, self.fact_watermark)
+        if transformed_data is not None and self.targets is not None:
+            transformed_data = {name: df for name, df in transformed_data.items() if name in self.targets}
         if transformed_data is not None:
             logger.info("✅ Transformation completed successfully.")    
         else:
             logger.error("❌ Transformation failed.")
         return transformed_data
     
+    def staged_keys(self, table_name: str, columns: list):
+        """
+        Distinct key columns of a table whose source is loaded by run_batched / run_native
+        in this run, scanned from the source files (only these columns are parsed)
+        Returns:
+            pl.DataFrame, or None if the table is not built from a staged source
+        """
+        sources = self.transformer.TABLE_SOURCES.get(table_name, [table_name])
+        if len(sources) != 1 or sources[0] not in self.batched_tables() + self.native_tables():
+            return None
+        lf = self.extractor.scan_csv(self.config.get_csv_path(sources[0]), sources[0])
+        if lf is None:
+            return None
+        return self.transformer.standardize_column_names(lf).select(columns).unique().collect()
+
+    def validation_references(self, tables: dict) -> tuple:
+        """
+        Keys for the foreign-key checks of tables
+        Returns:
+            tuple: (references, history)
+                references: referenced tables whose rows this run loads from a staged source
+                    (keys from the source files), or that are not part of this run (keys from
+                    the warehouse); the other ones are checked against tables itself
+                history: warehouse keys of referenced SCD2 dimensions of this run, so facts
+                    keep pointing at versions that scd2_merge expired
+        """
+        references, history = {}, {}
+        for ref_table, columns in self.validator.referenced_tables(list(tables)).items():
+            staged = self.staged_keys(ref_table, columns)
+            if staged is not None:
+                references[ref_table] = staged
+            elif ref_table not in tables:
+                # warehouse มีทุก version ของ SCD2 อยู่แล้ว
+                keys = self.loader.read_columns(ref_table, columns)
+                if keys is not None:
+                    references[ref_table] = keys
+                continue
+            if self.loader.scd2_key(ref_table):
+                keys = self.loader.read_columns(ref_table, columns)
+                if keys is not None:
+                    history[ref_table] = keys
+        return references, history
+
+    def source_references(self, raw_data: dict, sources: dict) -> dict:
+        """Source tables for the source-level checks of sources: raw_data, else the staged source files"""
+        references = {name: self.transformer.standardize_column_names(df) for name, df in raw_data.items()}
+        for ref_table, columns in self.validator.referenced_tables(list(sources)).items():
+            if ref_table not in references and ref_table not in sources:
+                staged = self.staged_keys(ref_table, columns)
+                if staged is not None:
+                    references[ref_table] = staged
+        return references
+
+    def run_validate(self, raw_data: dict, transformed_data: dict) -> dict:
+        """
+        Run the data-quality checks (Config.VALIDATE_DATA) between transform and load
+        Rows failing a check are removed and returned as reject_<table> tables,
+        which run_load writes next to the warehouse tables.
+        """
+        if not self.config.VALIDATE_DATA:
+            return transformed_data
+        logger.info("\n"+"="*50)
+        logger.info("Starting data validation...")
+        logger.info("="*50)
+
+        references, history = self.validation_references(transformed_data)
+        validated, rejects = self.validator.validate_all(transformed_data, references, history)
+
+        # source-level checks (เช่น order_items ที่ไม่มี order) เก็บเฉพาะแถวที่ไม่ผ่าน
+        sources = {name: self.transformer.standardize_column_names(df)
+                   for name, df in raw_data.items() if name in VALIDATION_RULES}
+        if sources:
+            raw_references = self.source_references(raw_data, sources)
+            _, source_rejects = self.validator.validate_all(sources, raw_references)
+            rejects.update(source_rejects)
+
+        self.loader.disconnect()
+        validated.update(rejects)
+        return validated
+
     def run_load(self, transformed_data: dict) -> bool:
         """
         Run the loading step to load transformed data into the data warehouse
@@ -75,7 +374,9 @@ class ETLPipeline:
         logger.info("="*50)
 
         #Load the DataLoader class
-        success = self.loader.load_all_data(transformed_data)
+        upsert_tables = self.UPSERT_KEYS if self.fact_watermark is not None else None
+        success = self.loader.load_all_data(transformed_data, full_refresh=self.targets is None,
+                                            upsert_tables=upsert_tables)
         
         if success:
             logger.info("✅ Data loading completed successfilly.")
@@ -87,18 +388,279 @@ class ETLPipeline:
 
         return success
 
+    def batched_tables(self) -> list:
+        """
+        Tables from Config.BATCHED_TABLES that can be streamed
+        orders and order_items are joined together, so only one of them can be batched.
+        """
+        batched = [t for t in self.config.BATCHED_TABLES if t in self.config.CSV_FILES
+                   and t not in self.config.DUCKDB_NATIVE_TABLES
+                   and (self.sources is None or t in self.sources)]
+        if "orders" in batched and "order_items" in batched:
+            logger.warning("orders and order_items cannot both be batched; reading orders in full")
+            batched.remove("orders")
+        # dims ก่อน fact เพื่อให้การตรวจ FK ของ fact เห็น dims ที่โหลดครบแล้ว
+        return sorted(batched, key=lambda t: t in ("orders", "order_items"))
+
+    def run_batched(self, raw_data: dict) -> bool:
+        """
+        Stream the batched tables: each batch is extracted, transformed and loaded
+        before the next one is read, so memory is bounded by Config.BATCH_SIZE
+        """
+        batched = self.batched_tables()
+        if not batched:
+            return True
+
+        logger.info("\n"+"="*50)
+        logger.info(f"Starting batched loading for {batched} (batch size {self.config.BATCH_SIZE})...")
+        logger.info("="*50)
+
+        # ตารางที่ fact ต้อง join ด้วยให้ collect ครั้งเดียว ไม่ใช่ทุก batch
+        raw_data = {name: (df.collect() if isinstance(df, pl.LazyFrame) else df)
+                    for name, df in raw_data.items()}
+
+        success = True
+        for table_name in batched:
+            file_path = self.config.get_csv_path(table_name)
+            incremental = self.fact_watermark is not None and table_name in ("orders", "order_items")
+            if incremental and table_name == "order_items":
+                # order หนึ่งอาจถูกแบ่งอยู่หลาย batch จึงลบ order ที่เปลี่ยนก่อนครั้งเดียว แล้ว append
+                orders = self.transformer.standardize_column_names(raw_data["orders"])
+                changed = orders.filter(self.transformer.changed_orders_filter(self.fact_watermark)).select("order_id")
+                if not self.loader.delete_keys("fact_sales", changed):
+                    success = False
+                    break
+            rows = 0
+            references, source_references, seen = None, None, None
+            for i, batch in enumerate(self.extractor.iter_csv_batches(file_path, table_name)):
+                if self.config.VALIDATE_DATA and table_name in VALIDATION_RULES:
+                    # source-level checks ของ batch (เช่น order_items ที่ไม่มี order)
+                    source = {table_name: self.transformer.standardize_column_names(batch)}
+                    if source_references is None:
+                        source_references = self.source_references(raw_data, source)
+                    _, rejected = self.validator.validate_table(table_name, source[table_name], source_references)
+                    if rejected is not None and not self.loader.load_dataframe(
+                            rejected, f"reject_{table_name}", "replace" if i == 0 else "append"):
+                        success = False
+                        break
+                result = self.transformer.transform_batch(table_name, batch, raw_data,
+                                                          self.fact_watermark if incremental else None)
+                if result is None:
+                    logger.warning(f"No batched transform for {table_name}; skipped")
+                    break
+                target, df = result
+                if self.config.VALIDATE_DATA:
+                    # key ที่อ้างถึง (รวมตารางตัวเอง เช่น manager_id) มาจากทั้งไฟล์ ไม่ใช่แค่ batch นี้
+                    # ครั้งเดียวต่อตาราง; primary key ตรวจข้าม batch ด้วย key ที่ผ่านไปแล้ว (seen)
+                    if references is None:
+                        references, history = self.validation_references({target: df})
+                    df, rejected = self.validator.validate_table(target, df, references, history, seen)
+                    if rejected is not None and not self.loader.load_dataframe(
+                            rejected, f"reject_{target}", "replace" if i == 0 else "append"):
+                        success = False
+                        break
+                    primary_key = self.validator.primary_key(target, df.columns)
+                    if primary_key:
+                        seen = df.select(primary_key) if seen is None else pl.concat([seen, df.select(primary_key)])
+                scd2_key = self.loader.scd2_key(target)
+                if scd2_key:
+                    # batch เดียวไม่ใช่ snapshot ทั้งหมด จึงไม่ expire key ที่ไม่อยู่ใน batch
+                    if not self.loader.load_dataframe(df, target, "scd2", [scd2_key], expire_missing=False):
+                        success = False
+                        break
+                    rows += len(df)
+                    continue
+                if incremental and table_name == "orders":
+                    mode = "upsert"
+                elif incremental:
+                    mode = "append"
+                else:
+                    mode = self.loader.replace_mode(target) if i == 0 else "append"
+                if not self.loader.load_dataframe(df, target, mode, self.UPSERT_KEYS.get(target)):
+                    success = False
+                    break
+                rows += len(df)
+            logger.info(f"✅ Batched load of {table_name} finished: {rows} rows")
+
+        self.loader.create_current_views()
+        self.loader.disconnect()
+        return success
+
+    def native_tables(self) -> list:
+        """Tables from Config.DUCKDB_NATIVE_TABLES that are needed in this run"""
+        return [t for t in self.config.DUCKDB_NATIVE_TABLES if t in self.config.CSV_FILES
+                and (self.sources is None or t in self.sources)]
+
+    def validate_native(self, table_name: str, query: str, sources: list) -> str:
+        """
+        Run the data-quality checks (Config.VALIDATE_DATA) on a table built with SQL
+        The rows of query are materialized once; rows failing a check are written to
+        reject_<table> and a query over the passing rows (flagged_<table>) is returned.
+        Foreign keys are looked up in the warehouse, where the dims of this run are
+        already loaded next to the expired versions of SCD2 dims.
+        Args:
+            sources: source tables staged as stg_<source> in this run (source-level checks)
+        Returns:
+            str: query of the rows that passed, query itself if the table has no rules
+        """
+        if not self.config.VALIDATE_DATA or table_name not in VALIDATION_RULES:
+            return query
+        connection = self.loader.connection
+        checked = f"chk_{table_name}"
+        connection.execute(f"CREATE OR REPLACE TEMP TABLE {checked} AS {query}")
+        columns = [row[0] for row in connection.execute(f"DESCRIBE {checked}").fetchall()]
+
+        existing = self.loader.existing_tables()
+        references = {}
+        for ref_table in self.validator.referenced_tables([table_name]):
+            if ref_table == table_name:
+                references[ref_table] = checked
+            elif ref_table in sources:
+                references[ref_table] = f"stg_{ref_table}"
+            elif ref_table in existing:
+                references[ref_table] = ref_table
+        checks = self.validator.build_sql_checks(table_name, columns, references)
+        if not checks:
+            connection.execute(f"DROP TABLE {checked}")
+            return query
+
+        connection.execute(f"""
+            CREATE OR REPLACE TEMP TABLE flagged_{table_name} AS
+            SELECT *, {self.validator.reject_reason_sql(checks)} AS reject_reason
+            FROM {checked}
+            ORDER BY rowid
+        """)
+        connection.execute(f"DROP TABLE {checked}")
+        connection.execute(f"""
+            CREATE OR REPLACE TABLE reject_{table_name} AS
+            SELECT *, CAST($rejected_at AS TIMESTAMP) AS rejected_at
+            FROM flagged_{table_name}
+            WHERE reject_reason <> ''
+        """, {"rejected_at": self.validator.run_timestamp})
+        rejected = connection.execute(f"SELECT count(*) FROM reject_{table_name}").fetchone()[0]
+        if rejected:
+            logger.warning(f"⚠️ {table_name}: {rejected} rows quarantined into reject_{table_name}")
+        return f"SELECT * EXCLUDE (reject_reason) FROM flagged_{table_name} WHERE reject_reason = ''"
+
+    def run_native(self, raw_data: dict) -> bool:
+        """
+        DuckDB-native path: stage the native tables with DuckDB's CSV reader and
+        build every table that depends on them with SQL inside the warehouse
+        With Config.VALIDATE_DATA the staged sources and the built tables go through
+        validate_native, so only the rows that pass are loaded.
+        """
+        native = self.native_tables()
+        if not native:
+            return True
+
+        logger.info("\n"+"="*50)
+        logger.info(f"Starting DuckDB-native loading for {native}...")
+        logger.info("="*50)
+
+        sql_transforms = self.transformer.get_sql_transforms()
+        targets = [table for table, sources in self.transformer.TABLE_SOURCES.items()
+                   if table in sql_transforms and any(src in native for src in sources)
+                   and (self.targets is None or table in self.targets)]
+        # dims ก่อน fact: FK ของตารางถัดไปเทียบกับแถวที่ผ่านการตรวจแล้วใน warehouse
+        targets = self.validator.validation_order(targets)
+
+        success = True
+        staged, registered = [], []
+        for table_name in native:
+            if not self.loader.stage_csv(table_name, self.config.get_csv_paths(table_name)):
+                success = False
+            staged.append(table_name)
+
+        # input ที่อ่านด้วย Polars ให้ SQL เห็นเป็น stg_<table> ผ่าน Arrow (ไม่ copy)
+        for table in targets:
+            for src in self.transformer.TABLE_SOURCES[table]:
+                if src not in native and src not in registered and src in raw_data:
+                    df = raw_data[src]
+                    df = df.collect() if isinstance(df, pl.LazyFrame) else df
+                    self.loader.connection.register(f"stg_{src}", df.to_arrow())
+                    registered.append(src)
+
+        try:
+            if success:
+                # source-level checks (เช่น order_items ที่ไม่มี order) เก็บเฉพาะแถวที่ไม่ผ่าน
+                for table_name in staged:
+                    self.validate_native(table_name, f"SELECT * FROM stg_{table_name}", staged + registered)
+                for table in targets:
+                    query, mode, keys = sql_transforms[table], self.loader.replace_mode(table), self.UPSERT_KEYS.get(table)
+                    if table == "fact_sales" and self.fact_watermark is not None:
+                        query = f"SELECT * FROM ({query}) WHERE {self.transformer.changed_orders_sql(self.fact_watermark)}"
+                        mode = "upsert"
+                    elif self.loader.scd2_key(table):
+                        mode, keys = "scd2", [self.loader.scd2_key(table)]
+                    query = self.validate_native(table, query, staged + registered)
+                    if not self.loader.run_sql_transform(table, query, mode, keys):
+                        success = False
+        except Exception as e:
+            logger.error(f"Error validating DuckDB-native tables: {str(e)}")
+            success = False
+
+        for src in registered:
+            self.loader.connection.unregister(f"stg_{src}")
+        for table_name in staged:
+            self.loader.connection.execute(f"DROP TABLE IF EXISTS stg_{table_name}")
+        for table_name in staged + targets:
+            self.loader.connection.execute(f"DROP TABLE IF EXISTS chk_{table_name}")
+            self.loader.connection.execute(f"DROP TABLE IF EXISTS flagged_{table_name}")
+        self.loader.create_current_views()
+        self.loader.disconnect()
+        return success
+
 def main():
     logger.info('🚀 ❤️ Starting Data Warehouse ETL Pipeline')
     # Run ETL pipeline
     pipeline = ETLPipeline()  # Create an instance of the ETLPipeline class
     success = pipeline.run_check_src()
+    if success and pipeline.config.BLUE_GREEN:
+        pipeline.loader.begin_build()
+    try:
+        run_steps(pipeline, success)
+    finally:
+        # build ที่ไม่ได้ publish (ล้มเหลว/ไม่มีอะไรเปลี่ยน) ถูกทิ้ง reader ยังใช้ version เดิม
+        pipeline.loader.discard_build()
+        # ปิด connection ที่ใช้ร่วมกันทั้งหมด (checkpoint ไฟล์ก่อนจบ process)
+        ConnectionManager.close_shared()
+
+def run_steps(pipeline: ETLPipeline, success: bool):
+    """Run the ETL steps after the source check"""
+    if success and pipeline.config.INCREMENTAL_RUNS and not pipeline.plan_incremental():
+        logger.info("✅ No source changed since the last run. Nothing to do.")
+        return
     if success:
+        pipeline.plan_fact_load()
         raw_data = pipeline.run_extract()
-        if raw_data:
+        if raw_data is not None:
             transformed_data = pipeline.run_transform(raw_data)
-            if transformed_data:
+            if transformed_data is not None:
+                transformed_data = pipeline.run_validate(raw_data, transformed_data)
 
                 success= pipeline.run_load(transformed_data)
+                if success:
+                    success = pipeline.run_batched(raw_data)
+                if success:
+                    success = pipeline.run_native(raw_data)
+                if success:
+                    success = pipeline.run_inventory_snapshot()
+                if success:
+                    success = pipeline.run_date_dimension()
+                if success:
+                    success = pipeline.run_partitions()
+                if success:
+                    success = pipeline.run_aggregates()
+                if success:
+                    success = pipeline.run_optimize()
+                if success:
+                    success = pipeline.run_export_lake()
+                if success:
+                    pipeline.update_watermarks()
+                if success and pipeline.config.INCREMENTAL_RUNS:
+                    pipeline.save_source_state()
+                if success and pipeline.config.BLUE_GREEN:
+                    success = pipeline.loader.publish()
                 if success:    
                     logger.info("✅ ETL pipeline completed successfully.")  
                     logger.info("You can now start the dashboard with: streamlit run.")
@@ -110,4 +672,8 @@ def main():
         return
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--rollback" in sys.argv:
+        # blue/green: กลับไปใช้ version ที่ publish ก่อนหน้า
+        sys.exit(0 if DataLoader().rollback_publish() else 1)
+    else:
+        main()
\ No newline at end of file
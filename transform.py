@@ -4,9 +4,9 @@ Data transformation module for creating dimensional model
 
 
 import polars as pl
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from src.config import Config
 
 
@@ -18,13 +18,57 @@ logging.basicConfig(level=getattr(logging, Config.LOG_LEVEL),
                     )
 logger = logging.getLogger(__name__)
 
+# DataFrame (eager) หรือ LazyFrame (lazy mode) ใช้ method เดียวกันได้
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+# ช่วงส่วนลดของ fact_sales.discount_bucket (เดิมคำนวณด้วย pd.cut ใน Sale_Dashboard)
+DISCOUNT_BUCKETS = ["0-10%", "10-20%", ">20%"]
+
+# ชนิดของ key ใน dims/fact: id ของ BikeStores เป็นเลขเรียงต่อเนื่องขนาดเล็กอยู่แล้ว จึงใช้เป็น key แบบแคบได้เลย
+KEY_TYPES = {
+    "order_id": pl.Int32,
+    "item_id": pl.Int16,
+    "customer_id": pl.Int32,
+    "product_id": pl.Int32,
+    "store_id": pl.Int16,
+    "staff_id": pl.Int16,
+    "manager_id": pl.Int16,
+    "brand_id": pl.Int16,
+    "category_id": pl.Int16,
+    "order_status_id": pl.Int8,
+}
+
+# attribute ที่มีค่าซ้ำกันมาก (low cardinality) เก็บเป็น dictionary (Categorical)
+CATEGORICAL_COLUMNS = [
+    "brand_name", "category_name", "store_name",
+    "store_city", "store_state", "customer_city", "customer_state",
+]
+
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December"]
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
 
 class DataTransformer:
+    # ตาราง warehouse -> source tables ที่ใช้สร้าง (ใช้ตัดสินใจใน incremental runs)
+    TABLE_SOURCES = {
+        "dim_customers": ["customers"],
+        "dim_products": ["products"],
+        "dim_brands": ["brands"],
+        "dim_categories": ["categories"],
+        "dim_stores": ["stores"],
+        "dim_staffs": ["staffs"],
+        "fact_sales": ["orders", "order_items"],
+        "fact_inventory": ["stocks"],
+    }
+
     def __init__(self):
         self.config = Config()
+        # เวลาเดียวของทั้ง run ใช้เป็น created_at / updated_at ทุกตาราง
+        self.run_timestamp = datetime.now()
 
 
-    def standardize_column_names(self, df: pl.DataFrame) -> pl.DataFrame:
+    def standardize_column_names(self, df: Frame) -> Frame:
         """
         Standardize column names by converting to lowercase and replacing spaces and hyphens with underscores.
        
@@ -33,8 +77,20 @@ class DataTransformer:
         Returns:
             DataFrame with standardized column names    
         """
-        new_columns = [col.lower().replace(' ', '_').replace('-', '_') for col in df.columns]
-        return df.rename(dict(zip(df.columns, new_columns)))
+        columns = df.collect_schema().names()
+        new_columns = [col.lower().replace(' ', '_').replace('-', '_') for col in columns]
+        return df.rename(dict(zip(columns, new_columns)))
+
+    def compact_types(self, df: Frame) -> Frame:
+        """
+        Cast key columns to KEY_TYPES and low-cardinality attributes to Categorical
+        Keeps dims and facts narrow even when a source was read without a pinned schema.
+        """
+        schema = df.collect_schema()
+        casts = {col: dtype for col, dtype in KEY_TYPES.items() if col in schema and schema[col] != dtype}
+        casts.update({col: pl.Categorical for col in CATEGORICAL_COLUMNS
+                      if col in schema and not isinstance(schema[col], pl.Categorical)})
+        return df.cast(casts) if casts else df
    
     def transform_brands(self, df: pl.DataFrame) -> pl.DataFrame:
         """Transform brands data into dimension table"""
@@ -43,9 +99,9 @@ class DataTransformer:
         dim_brands = df_clean.select(
             pl.col("brand_id"),
             pl.col("brand_name"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
-        ).sort("brand_id").filter(pl.col("brand_id").is_not_null())
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
+        ).filter(pl.col("brand_id").is_not_null()).sort("brand_id")
         return dim_brands
 
 
@@ -56,9 +112,9 @@ class DataTransformer:
         dim_categories = df_clean.select(
             pl.col("category_id"),
             pl.col("category_name"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
-        ).sort("category_id").filter(pl.col("category_id").is_not_null())
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
+        ).filter(pl.col("category_id").is_not_null()).sort("category_id")
         return dim_categories
 
 
@@ -75,9 +131,9 @@ class DataTransformer:
             pl.col("city").alias("store_city"),
             pl.col("state").alias("store_state"),
             pl.col("zip_code").alias("store_zip_code"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
-        ).sort("store_id").filter(pl.col("store_id").is_not_null())
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
+        ).filter(pl.col("store_id").is_not_null()).sort("store_id")
         return dim_stores
 
 
@@ -99,9 +155,9 @@ class DataTransformer:
                 pl.col("last_name"),
                 separator=" "
             ).alias("staff_fullname"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
-        ).sort("staff_id").filter(pl.col("staff_id").is_not_null())
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
+        ).filter(pl.col("staff_id").is_not_null()).sort("staff_id")
         return dim_staffs
 
 
@@ -124,9 +180,9 @@ class DataTransformer:
                 pl.col("last_name"),
                 separator=" "
             ).alias("customer_fullname"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
-        ).sort("customer_id").filter(pl.col("customer_id").is_not_null())
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
+        ).filter(pl.col("customer_id").is_not_null()).sort("customer_id")
         return dim_customers
 
 
@@ -141,11 +197,11 @@ class DataTransformer:
             pl.col("category_id"),
             pl.col("model_year"),
             pl.col("list_price"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
         )
-        .sort(pl.col("product_id"))
-        .filter(pl.col("product_id").is_not_null()))
+        .filter(pl.col("product_id").is_not_null())
+        .sort(pl.col("product_id")))
         return dim_product
    
     def get_fiscal_quarter(self, start_month: int) -> pl.Expr:
@@ -157,41 +213,76 @@ class DataTransformer:
         ) + 1
 
 
-    def create_date_dimension(self) -> pl.DataFrame:
+    def date_key(self, col: pl.Expr) -> pl.Expr:
+        """Int32 YYYYMMDD key of a date column (same value as dim_date.date_key)"""
+        return (col.dt.year() * 10000 + col.dt.month().cast(pl.Int32) * 100 + col.dt.day()).cast(pl.Int32)
+
+    def create_date_dimension(self, start: date, end: date) -> pl.DataFrame:
         """
-        Create a date dimension table
+        Create the date dimension rows for start..end (inclusive)
+        The range comes from the fact dates; see ETLPipeline.run_date_dimension.
         """
         date_range = pl.date_range(
-            start=pl.datetime(2015, 1, 1),
-            end=pl.datetime(2025, 12, 31),
+            start=start,
+            end=end,
             interval="1d",
             eager=True
-        )
+        ).alias("date")
 
 
         dim_date = pl.DataFrame({
-            "date_key": date_range,
+            "date_key": pl.select(self.date_key(pl.lit(date_range))).to_series(),
             "date": date_range,
             "year": date_range.dt.year(),
             "quarter": date_range.dt.quarter(),
             "month": date_range.dt.month(),
-            "month_name": date_range.dt.strftime("%B"),
+            "month_name": date_range.dt.strftime("%B").cast(pl.Enum(MONTH_NAMES)),
             "day": date_range.dt.day(),
             "day_of_week": date_range.dt.weekday(),
-            "day_name": date_range.dt.strftime("%A"),
+            "day_name": date_range.dt.strftime("%A").cast(pl.Enum(DAY_NAMES)),
             "week_of_year": date_range.dt.week(),
             "is_weekend": date_range.dt.weekday().is_in([6, 7])
         })
 
 
         dim_date = dim_date.with_columns(
-            self.get_fiscal_quarter(10).alias("fiscal_quarter")
+            self.get_fiscal_quarter(10).alias("fiscal_quarter"),
+            # label ของงวด (รูปแบบเดียวกับ pandas to_period().astype(str) ที่ dashboard เคยคำนวณ)
+            date_range.dt.strftime("%Y-%m").alias("month_label"),
+            pl.format("{}Q{}", date_range.dt.year(), date_range.dt.quarter()).alias("quarter_label")
         )
         return dim_date
 
 
-    def transform_sales_fact(self, orders_df: pl.DataFrame, order_items_df: pl.DataFrame) -> pl.DataFrame:
-        """Transform orders and order items into sales fact table"""
+    def changed_orders_since(self, watermark: tuple) -> tuple:
+        """
+        Lower bounds of the orders an incremental fact load has to (re)process
+        Args:
+            watermark: (max_order_id, max_order_date) of the last load
+        Returns:
+            tuple: (max_order_id, earliest order_date still open for late updates)
+        """
+        max_order_id, max_order_date = watermark
+        return max_order_id, max_order_date - timedelta(days=self.config.FACT_CHANGE_WINDOW_DAYS)
+
+    def changed_orders_filter(self, watermark: tuple) -> pl.Expr:
+        """Orders that are new (order_id above the mark) or inside the change window"""
+        max_order_id, since_date = self.changed_orders_since(watermark)
+        return (pl.col("order_id") > max_order_id) | (pl.col("order_date") >= since_date)
+
+    def changed_orders_sql(self, watermark: tuple) -> str:
+        """SQL version of changed_orders_filter"""
+        max_order_id, since_date = self.changed_orders_since(watermark)
+        return f"order_id > {max_order_id} OR order_date >= DATE '{since_date.isoformat()}'"
+
+    def transform_sales_fact(self, orders_df: pl.DataFrame, order_items_df: pl.DataFrame,
+                             watermark: Optional[tuple] = None) -> pl.DataFrame:
+        """
+        Transform orders and order items into sales fact table
+        Args:
+            watermark: (max_order_id, max_order_date) of the last load; only new or
+                recently changed orders are transformed when given
+        """
         logger.info("===Transforming sales fact table===")
 
 
@@ -199,6 +290,10 @@ class DataTransformer:
         df_orders = self.standardize_column_names(orders_df)
         df_order_items = self.standardize_column_names(order_items_df)
 
+        # Incremental: กรอง orders ก่อน join เพื่อไม่ต้อง join ทั้งประวัติ
+        if watermark is not None:
+            df_orders = df_orders.filter(self.changed_orders_filter(watermark))
+
 
         # Join orders with order items
         df_order_join = df_orders.join(
@@ -208,32 +303,201 @@ class DataTransformer:
             how="inner"
         )
        
-        # Select columns and calculate metrics
+        # Select columns and calculate metrics (ครบทุกคอลัมน์ตาม DDL ของ fact_sales)
         sales_fact = df_order_join.select([
             pl.col("order_id"),
+            pl.col("item_id"),
             pl.col("customer_id"),
             pl.col("store_id"),
             pl.col("staff_id"),
             pl.col("product_id"),
+            pl.col("order_status").alias("order_status_id"),
+            self.date_key(pl.col("order_date")).alias("order_date_key"),
+            self.date_key(pl.col("required_date")).alias("required_date_key"),
+            self.date_key(pl.col("shipped_date")).alias("shipped_date_key"),
             pl.col("order_date"),
             pl.col("shipped_date"),
             pl.col("quantity"),
             pl.col("list_price"),
             pl.col("discount"),
             (pl.col("quantity") * pl.col("list_price")).alias("gross_amount"),
+            (pl.col("quantity") * pl.col("list_price") * pl.col("discount")).alias("discount_amount"),
             (pl.col("quantity") * pl.col("list_price") * (1 - pl.col("discount"))).alias("net_amount"),
-            pl.lit(datetime.now()).alias("created_at"),
-            pl.lit(datetime.now()).alias("updated_at")
+            (pl.col("shipped_date") - pl.col("order_date")).dt.total_days().cast(pl.Int32).alias("order_to_ship_days"),
+            # ยังไม่ส่ง = ไม่ตรงเวลา
+            (pl.col("shipped_date") <= pl.col("required_date")).fill_null(False).alias("shipped_on_time"),
+            (pl.col("discount") * 100).alias("discount_pct"),
+            pl.when(pl.col("discount") <= 0.1).then(pl.lit(DISCOUNT_BUCKETS[0]))
+              .when(pl.col("discount") <= 0.2).then(pl.lit(DISCOUNT_BUCKETS[1]))
+              .when(pl.col("discount") <= 1).then(pl.lit(DISCOUNT_BUCKETS[2]))
+              .cast(pl.Enum(DISCOUNT_BUCKETS))
+              .alias("discount_bucket"),
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
         ])
        
         return sales_fact
    
-    def transform_all_data(self, raw_data: Dict[str, pl.DataFrame]) -> Dict[str, pl.DataFrame]:
+    def transform_inventory(self, stocks_df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Transform stocks into the current on-hand inventory fact (grain = store x product)
+        Daily history is kept separately as change rows; see DataLoader.snapshot_inventory.
+        """
+        logger.info("===Transforming inventory fact table===")
+        df_stocks = self.standardize_column_names(stocks_df)
+        fact_inventory = df_stocks.select(
+            pl.col("store_id"),
+            pl.col("product_id"),
+            pl.col("quantity").alias("quantity_on_hand"),
+            pl.lit(self.run_timestamp).alias("created_at"),
+            pl.lit(self.run_timestamp).alias("updated_at")
+        ).sort("store_id", "product_id")
+        return fact_inventory
+
+    def get_sql_transforms(self) -> Dict[str, str]:
+        """
+        SQL versions of the transforms, run inside DuckDB (DuckDB-native path)
+        Each query reads the staging tables stg_<source> and returns the same
+        columns as the matching transform_* method.
+        """
+        return {
+            "dim_brands": """
+                SELECT brand_id, brand_name,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_brands
+                WHERE brand_id IS NOT NULL
+                ORDER BY brand_id
+            """,
+            "dim_categories": """
+                SELECT category_id, category_name,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_categories
+                WHERE category_id IS NOT NULL
+                ORDER BY category_id
+            """,
+            "dim_stores": """
+                SELECT store_id, store_name,
+                       phone AS store_phone, email AS store_email, street AS store_street,
+                       city AS store_city, state AS store_state, zip_code AS store_zip_code,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_stores
+                WHERE store_id IS NOT NULL
+                ORDER BY store_id
+            """,
+            "dim_staffs": """
+                SELECT staff_id,
+                       first_name AS staff_firstname, last_name AS staff_lastname,
+                       email AS staff_email, phone AS staff_phone, active AS staff_active,
+                       store_id, manager_id,
+                       first_name || ' ' || last_name AS staff_fullname,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_staffs
+                WHERE staff_id IS NOT NULL
+                ORDER BY staff_id
+            """,
+            "dim_customers": """
+                SELECT customer_id,
+                       first_name AS customer_firstname, last_name AS customer_lastname,
+                       phone AS customer_phone, email AS customer_email, street AS customer_street,
+                       city AS customer_city, state AS customer_state, zip_code AS customer_zipcode,
+                       first_name || ' ' || last_name AS customer_fullname,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_customers
+                WHERE customer_id IS NOT NULL
+                ORDER BY customer_id
+            """,
+            "dim_products": """
+                SELECT product_id, product_name, brand_id, category_id, model_year, list_price,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_products
+                WHERE product_id IS NOT NULL
+                ORDER BY product_id
+            """,
+            "fact_sales": """
+                SELECT o.order_id, i.item_id, o.customer_id, o.store_id, o.staff_id, i.product_id,
+                       o.order_status AS order_status_id,
+                       CAST(strftime(o.order_date, '%Y%m%d') AS INTEGER) AS order_date_key,
+                       CAST(strftime(o.required_date, '%Y%m%d') AS INTEGER) AS required_date_key,
+                       CAST(strftime(o.shipped_date, '%Y%m%d') AS INTEGER) AS shipped_date_key,
+                       o.order_date, o.shipped_date,
+                       i.quantity, i.list_price, i.discount,
+                       i.quantity * i.list_price AS gross_amount,
+                       i.quantity * i.list_price * i.discount AS discount_amount,
+                       i.quantity * i.list_price * (1 - i.discount) AS net_amount,
+                       CAST(date_diff('day', o.order_date, o.shipped_date) AS INTEGER) AS order_to_ship_days,
+                       coalesce(o.shipped_date <= o.required_date, false) AS shipped_on_time,
+                       i.discount * 100 AS discount_pct,
+                       CAST(CASE WHEN i.discount <= 0.1 THEN '0-10%'
+                                 WHEN i.discount <= 0.2 THEN '10-20%'
+                                 WHEN i.discount <= 1 THEN '>20%' END
+                            AS ENUM('0-10%', '10-20%', '>20%')) AS discount_bucket,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_orders o
+                JOIN stg_order_items i ON o.order_id = i.order_id
+            """,
+            "fact_inventory": """
+                SELECT store_id, product_id, quantity AS quantity_on_hand,
+                       localtimestamp AS created_at, localtimestamp AS updated_at
+                FROM stg_stocks
+                ORDER BY store_id, product_id
+            """,
+        }
+
+    def transform_batch(self, table_name: str, batch: pl.DataFrame, raw_data: Dict[str, Frame],
+                        fact_watermark: Optional[tuple] = None) -> Optional[tuple]:
+        """
+        Transform one batch of a source table (batched mode)
+        Args:
+            table_name: source table the batch came from
+            batch: rows of the batch
+            raw_data: the fully extracted tables (fact batches are joined against them)
+            fact_watermark: watermark for incremental fact loads
+        Returns:
+            tuple: (target table name, transformed DataFrame), or None if no target uses the table
+        """
+        if table_name == "order_items":
+            return "fact_sales", self.compact_types(self.transform_sales_fact(raw_data["orders"], batch, fact_watermark))
+        if table_name == "orders":
+            return "fact_sales", self.compact_types(self.transform_sales_fact(batch, raw_data["order_items"], fact_watermark))
+        if table_name == "stocks":
+            return "fact_inventory", self.compact_types(self.transform_inventory(batch))
+
+        dim_transforms = {
+            "customers": self.transform_customers,
+            "products": self.transform_products,
+            "brands": self.transform_brands,
+            "categories": self.transform_categories,
+            "stores": self.transform_stores,
+            "staffs": self.transform_staffs,
+        }
+        if table_name in dim_transforms:
+            return f"dim_{table_name}", self.compact_types(dim_transforms[table_name](batch))
+        return None
+
+    def collect_plans(self, plans: Dict[str, pl.LazyFrame]) -> Dict[str, pl.DataFrame]:
+        """
+        Collect every table plan with one pl.collect_all call
+        The plans run in parallel and inputs shared by several tables are computed once.
+        """
+        if self.config.EXPLAIN_PLANS:
+            for name, plan in plans.items():
+                logger.info(f"Optimized plan for {name}:\n{plan.explain()}")
+        engine = "streaming" if self.config.STREAMING_COLLECT else "auto"
+        frames = pl.collect_all(list(plans.values()), engine=engine)
+        return dict(zip(plans, frames))
+
+    def transform_all_data(self, raw_data: Dict[str, Frame], fact_watermark: Optional[tuple] = None) -> Dict[str, Frame]:
         """
         Transform all raw data into dimensional model
+        Every table is built as a LazyFrame plan and all plans are collected
+        together in parallel. In lazy mode the plans are returned as they are
+        and DataLoader collects them at load time, together with the extract scans.
+        Args:
+            fact_watermark: when given, fact_sales only contains new/changed orders (incremental load)
         """
         logger.info("Starting data transformation process")
         transformed = {}
+        raw_data = {name: df.lazy() for name, df in raw_data.items()}
        
         # Create dimensions
         if "customers" in raw_data:
@@ -256,17 +520,21 @@ class DataTransformer:
             transformed["dim_staffs"] = self.transform_staffs(raw_data["staffs"])
 
 
-        # Create date dimension
-        transformed["dim_date"] = self.create_date_dimension()
-
-
         # Create fact tables
         if "orders" in raw_data and "order_items" in raw_data:
             transformed["fact_sales"] = self.transform_sales_fact(
                 raw_data["orders"],
-                raw_data["order_items"]
+                raw_data["order_items"],
+                fact_watermark
             )
 
+        if "stocks" in raw_data:
+            transformed["fact_inventory"] = self.transform_inventory(raw_data["stocks"])
+
+
+        transformed = {name: self.compact_types(df) for name, df in transformed.items()}
+        if not self.config.LAZY_MODE:
+            transformed = self.collect_plans(transformed)
 
         logger.info(f"Transformation complete. Created {len(transformed)} tables")
         return transformed
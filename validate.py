@@ -0,0 +1,291 @@
+"""
+Data validation module: declarative data-quality checks between transform and load
+"""
+
+
+import polars as pl
+from typing import Dict, List, Optional, Tuple, Union
+import logging
+from datetime import datetime
+from src.config import Config
+
+
+# Setup logging
+logging.basicConfig(level=getattr(logging, Config.LOG_LEVEL),
+                    format='%(asctime)s - %(levelname)s - %(message)s'
+                    )
+logger = logging.getLogger(__name__)
+
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+# ธงชั่วคราวของ validate_table: primary key นี้ผ่านไปแล้วใน batch ก่อนหน้า
+SEEN_COLUMN = "__seen_key"
+
+# Checks per table
+#   primary_key: columns that must be unique together
+#   not_null: columns that must have a value
+#   ranges: column -> (min, max), None = no bound
+#   foreign_keys: column -> (referenced table, referenced column); NULL ผ่าน (ใช้ not_null ถ้าบังคับ)
+VALIDATION_RULES = {
+    "dim_customers": {
+        "primary_key": ["customer_id"],
+        "not_null": ["customer_id"],
+    },
+    "dim_products": {
+        "primary_key": ["product_id"],
+        "not_null": ["product_id"],
+        "ranges": {"list_price": (0, None)},
+        "foreign_keys": {
+            "brand_id": ("dim_brands", "brand_id"),
+            "category_id": ("dim_categories", "category_id"),
+        },
+    },
+    "dim_brands": {
+        "primary_key": ["brand_id"],
+        "not_null": ["brand_id"],
+    },
+    "dim_categories": {
+        "primary_key": ["category_id"],
+        "not_null": ["category_id"],
+    },
+    "dim_stores": {
+        "primary_key": ["store_id"],
+        "not_null": ["store_id"],
+    },
+    "dim_staffs": {
+        "primary_key": ["staff_id"],
+        "not_null": ["staff_id"],
+        "foreign_keys": {
+            "store_id": ("dim_stores", "store_id"),
+            "manager_id": ("dim_staffs", "staff_id"),
+        },
+    },
+    "fact_sales": {
+        "primary_key": ["order_id", "item_id"],
+        "not_null": ["order_id", "item_id", "customer_id", "store_id", "staff_id", "product_id",
+                     "order_date", "quantity", "list_price"],
+        "ranges": {"quantity": (1, None), "list_price": (0, None), "discount": (0, 1)},
+        "foreign_keys": {
+            "customer_id": ("dim_customers", "customer_id"),
+            "product_id": ("dim_products", "product_id"),
+            "store_id": ("dim_stores", "store_id"),
+            "staff_id": ("dim_staffs", "staff_id"),
+        },
+    },
+    "fact_inventory": {
+        "primary_key": ["store_id", "product_id"],
+        "not_null": ["store_id", "product_id", "quantity_on_hand"],
+        "ranges": {"quantity_on_hand": (0, None)},
+        "foreign_keys": {
+            "store_id": ("dim_stores", "store_id"),
+            "product_id": ("dim_products", "product_id"),
+        },
+    },
+    # source table: order_items ที่ไม่มี order จะหายไปเงียบๆ ใน inner join ของ transform_sales_fact
+    "order_items": {
+        "foreign_keys": {"order_id": ("orders", "order_id")},
+    },
+}
+
+
+class DataValidator:
+    """Run VALIDATION_RULES over transformed tables and split off the failing rows"""
+
+    def __init__(self):
+        self.config = Config()
+        self.run_timestamp = datetime.now()
+
+    def referenced_tables(self, table_names: List[str]) -> Dict[str, List[str]]:
+        """
+        Tables (and their key columns) that the foreign-key checks of table_names look up
+        """
+        referenced = {}
+        for table_name in table_names:
+            for ref_table, ref_col in VALIDATION_RULES.get(table_name, {}).get("foreign_keys", {}).values():
+                referenced.setdefault(ref_table, [])
+                if ref_col not in referenced[ref_table]:
+                    referenced[ref_table].append(ref_col)
+        return referenced
+
+    def key_set(self, frame: Frame, column: str) -> pl.Series:
+        """Distinct non-null values of a referenced key column"""
+        keys = frame.select(pl.col(column).drop_nulls().unique())
+        if isinstance(keys, pl.LazyFrame):
+            keys = keys.collect()
+        return keys.to_series()
+
+    def primary_key(self, table_name: str, columns: List[str]) -> List[str]:
+        """Primary-key columns of a table that are present in columns"""
+        return [col for col in VALIDATION_RULES.get(table_name, {}).get("primary_key", []) if col in columns]
+
+    def build_checks(self, table_name: str, columns: List[str], references: Dict[str, Frame],
+                     history: Optional[Dict[str, Frame]] = None) -> Dict[str, pl.Expr]:
+        """
+        Build one boolean expression per check (True = the row passes)
+        Args:
+            columns: columns of the table; checks on other columns are skipped
+            references: referenced tables for the foreign-key checks
+            history: extra keys that stay valid for the foreign-key checks
+                (expired versions of SCD2 dimensions kept in the warehouse)
+        """
+        rules = VALIDATION_RULES.get(table_name, {})
+        history = history or {}
+        checks = {}
+
+        for col in rules.get("not_null", []):
+            if col in columns:
+                checks[f"not_null:{col}"] = pl.col(col).is_not_null()
+
+        primary_key = self.primary_key(table_name, columns)
+        if primary_key:
+            # แถวแรกของ key ที่ซ้ำผ่าน เฉพาะแถวที่ซ้ำถูกแยกออก (เหมือน batched mode)
+            unique = pl.struct(primary_key).is_first_distinct()
+            if SEEN_COLUMN in columns:
+                unique = unique & pl.col(SEEN_COLUMN).is_null()
+            checks[f"unique:{'+'.join(primary_key)}"] = unique
+
+        for col, (low, high) in rules.get("ranges", {}).items():
+            if col in columns:
+                in_range = pl.lit(True)
+                if low is not None:
+                    in_range = in_range & (pl.col(col) >= low)
+                if high is not None:
+                    in_range = in_range & (pl.col(col) <= high)
+                checks[f"range:{col}"] = in_range.fill_null(True)
+
+        for col, (ref_table, ref_col) in rules.get("foreign_keys", {}).items():
+            if col not in columns:
+                continue
+            if ref_table not in references:
+                logger.warning(f"{table_name}.{col}: {ref_table} not available; foreign-key check skipped")
+                continue
+            keys = self.key_set(references[ref_table], ref_col)
+            if ref_table in history:
+                kept = self.key_set(history[ref_table], ref_col).cast(keys.dtype, strict=False)
+                keys = pl.concat([keys, kept]).unique()
+            checks[f"fk:{col}"] = pl.col(col).is_in(keys.implode()) | pl.col(col).is_null()
+
+        return checks
+
+    def build_sql_checks(self, table_name: str, columns: List[str], references: Dict[str, str],
+                         order: str = "rowid") -> Dict[str, str]:
+        """
+        SQL version of build_checks for tables built inside DuckDB (DuckDB-native path)
+        Args:
+            columns: columns of the table; checks on other columns are skipped
+            references: referenced table -> relation holding its keys
+            order: SQL expression giving the row order; the first row of a repeated key passes
+        Returns:
+            dict: check name -> SQL boolean expression (true = the row passes)
+        """
+        rules = VALIDATION_RULES.get(table_name, {})
+        checks = {}
+
+        for col in rules.get("not_null", []):
+            if col in columns:
+                checks[f"not_null:{col}"] = f"{col} IS NOT NULL"
+
+        primary_key = self.primary_key(table_name, columns)
+        if primary_key:
+            checks[f"unique:{'+'.join(primary_key)}"] = (
+                f"row_number() OVER (PARTITION BY {', '.join(primary_key)} ORDER BY {order}) = 1"
+            )
+
+        for col, (low, high) in rules.get("ranges", {}).items():
+            if col in columns:
+                bounds = ([f"{col} >= {low}"] if low is not None else []) + \
+                         ([f"{col} <= {high}"] if high is not None else [])
+                if bounds:
+                    checks[f"range:{col}"] = f"coalesce({' AND '.join(bounds)}, true)"
+
+        for col, (ref_table, ref_col) in rules.get("foreign_keys", {}).items():
+            if col not in columns:
+                continue
+            if ref_table not in references:
+                logger.warning(f"{table_name}.{col}: {ref_table} not available; foreign-key check skipped")
+                continue
+            checks[f"fk:{col}"] = f"({col} IS NULL OR {col} IN (SELECT {ref_col} FROM {references[ref_table]}))"
+
+        return checks
+
+    def reject_reason_sql(self, checks: Dict[str, str]) -> str:
+        """SQL expression joining the names of the failed checks ('' = every check passed)"""
+        failed = [f"CASE WHEN NOT ({passed}) THEN '{name}' END" for name, passed in checks.items()]
+        return f"concat_ws(', ', {', '.join(failed)})"
+
+    def validation_order(self, table_names: List[str]) -> List[str]:
+        """table_names ordered so that tables referenced by a foreign key come before the tables using them"""
+        ordered, remaining = [], list(table_names)
+        while remaining:
+            ready = [name for name in remaining
+                     if not any(ref in remaining and ref != name for ref in self.referenced_tables([name]))]
+            table_name = ready[0] if ready else remaining[0]
+            remaining.remove(table_name)
+            ordered.append(table_name)
+        return ordered
+
+    def validate_table(self, table_name: str, df: Frame, references: Optional[Dict[str, Frame]] = None,
+                       history: Optional[Dict[str, Frame]] = None,
+                       seen: Optional[pl.DataFrame] = None) -> Tuple[Frame, Optional[Frame]]:
+        """
+        Evaluate every check of a table in a single pass
+        Args:
+            history: see build_checks
+            seen: primary keys accepted in earlier batches of the same table (batched mode);
+                rows repeating one of them fail the unique check
+        Returns:
+            tuple: (rows that passed, rejected rows with reject_reason / rejected_at),
+                rejected is None if the table has no rules
+        """
+        if table_name not in VALIDATION_RULES:
+            return df, None
+        references = dict(references or {})
+        references.setdefault(table_name, df)
+
+        primary_key = self.primary_key(table_name, df.collect_schema().names())
+        if seen is not None and primary_key:
+            df = df.join(seen.unique().with_columns(pl.lit(True).alias(SEEN_COLUMN)),
+                         on=primary_key, how="left", maintain_order="left")
+
+        checks = self.build_checks(table_name, df.collect_schema().names(), references, history)
+        if not checks:
+            return df, None
+
+        # ชื่อ check ที่ไม่ผ่านต่อกันเป็นเหตุผล ("" = ผ่านทุก check)
+        reason = pl.concat_str(
+            [pl.when(~passed).then(pl.lit(name)) for name, passed in checks.items()],
+            separator=", ", ignore_nulls=True
+        ).alias("reject_reason")
+        flagged = df.with_columns(reason)
+
+        flagged = flagged.drop(SEEN_COLUMN, strict=False)
+        clean = flagged.filter(pl.col("reject_reason") == "").drop("reject_reason")
+        rejected = flagged.filter(pl.col("reject_reason") != "").with_columns(
+            pl.lit(self.run_timestamp).alias("rejected_at")
+        )
+        if isinstance(rejected, pl.DataFrame) and len(rejected) > 0:
+            logger.warning(f"⚠️ {table_name}: {len(rejected)} rows quarantined into reject_{table_name}")
+        return clean, rejected
+
+    def validate_all(self, tables: Dict[str, Frame], references: Optional[Dict[str, Frame]] = None,
+                     history: Optional[Dict[str, Frame]] = None) -> Tuple[Dict[str, Frame], Dict[str, Frame]]:
+        """
+        Validate every table that has rules
+        Args:
+            tables: tables to check
+            references: extra tables for foreign-key checks (tables in this run take precedence)
+            history: see build_checks
+        Returns:
+            tuple: (tables with the bad rows removed, reject_<table> -> rejected rows)
+        """
+        logger.info("Starting data validation")
+        references = {**(references or {}), **tables}
+        clean, rejects = {}, {}
+        # ตารางที่ถูกอ้างถึงต้องตรวจก่อน เพื่อให้ FK เทียบกับแถวที่ผ่านแล้วเท่านั้น
+        for table_name in self.validation_order(list(tables)):
+            clean[table_name], rejected = self.validate_table(table_name, tables[table_name], references, history)
+            references[table_name] = clean[table_name]
+            if rejected is not None:
+                rejects[f"reject_{table_name}"] = rejected
+        logger.info(f"Validation complete: {len(rejects)} tables checked")
+        return clean, rejects